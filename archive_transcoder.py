@@ -0,0 +1,221 @@
+"""
+Archive Transcoder
+
+This script shrinks the processed_audio archive by transcoding processed recordings
+to speech-tuned Opus. It is meant to run in the background at the lowest CPU priority:
+- Before and during each transcode it yields whenever local_whisper.py is running
+  (including --reprocess-degraded passes), so it never competes with transcription
+- The Opus file's duration is checked against the original before anything is replaced
+- The new file is moved into place atomically and only then is the original removed
+- Bytes saved are accumulated in a ledger inside the processed directory
+"""
+
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from config_loader import load_config
+from ffmpeg_utils import setup_ffmpeg_path, probe_duration
+from transcriber_lock import transcriber_running
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('archive_transcoder.log'),
+        logging.StreamHandler()
+    ]
+)
+
+# Same set local_whisper.py transcribes, minus the Opus files we produce
+SOURCE_EXTENSIONS = ('.mp3', '.wav', '.m4a', '.flac', '.aac', '.ogg', '.wma')
+LEDGER_NAME = '.transcode_ledger.json'
+
+def lower_priority():
+    """Drop this process to idle/lowest CPU priority"""
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            IDLE_PRIORITY_CLASS = 0x40
+            ctypes.windll.kernel32.SetPriorityClass(ctypes.windll.kernel32.GetCurrentProcess(), IDLE_PRIORITY_CLASS)
+        else:
+            os.nice(19)
+    except Exception as e:
+        logging.warning(f"Could not lower process priority: {str(e)}")
+
+def wait_for_idle(poll_seconds):
+    """Block until no transcriber is running"""
+    waited = False
+    while transcriber_running():
+        if not waited:
+            logging.info("Transcription running, pausing archive transcoding")
+            waited = True
+        time.sleep(poll_seconds)
+    if waited:
+        logging.info("Transcription idle, resuming archive transcoding")
+
+def load_ledger(ledger_path):
+    try:
+        with open(ledger_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"files": 0, "bytes_before": 0, "bytes_after": 0, "bytes_saved": 0}
+
+def save_ledger(ledger_path, ledger):
+    temp_path = ledger_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(ledger, f, indent=2)
+    os.replace(temp_path, ledger_path)
+
+def run_yielding(command, poll_seconds):
+    """
+    Run FFmpeg at idle priority; on POSIX the process is also suspended with
+    SIGSTOP while a transcriber is running and resumed afterwards.
+    """
+    # FFmpeg's errors go to a file: nothing reads them during the poll loop, and a
+    # full pipe would block FFmpeg for good
+    errors_file = tempfile.TemporaryFile()
+    if sys.platform == 'win32':
+        process = subprocess.Popen(
+            command, stdout=subprocess.DEVNULL, stderr=errors_file,
+            creationflags=subprocess.IDLE_PRIORITY_CLASS
+        )
+    else:
+        process = subprocess.Popen(
+            command, stdout=subprocess.DEVNULL, stderr=errors_file,
+            preexec_fn=lambda: os.nice(19)
+        )
+
+    can_suspend = hasattr(signal, 'SIGSTOP')
+    suspended = False
+    while process.poll() is None:
+        if can_suspend:
+            busy = transcriber_running()
+            if busy and not suspended:
+                process.send_signal(signal.SIGSTOP)
+                suspended = True
+            elif not busy and suspended:
+                process.send_signal(signal.SIGCONT)
+                suspended = False
+        time.sleep(poll_seconds if suspended else 1)
+
+    errors_file.seek(0)
+    errors = errors_file.read().decode('utf-8', errors='replace').strip()
+    errors_file.close()
+    if process.returncode != 0:
+        raise RuntimeError(errors or f"ffmpeg exited with code {process.returncode}")
+
+def transcode_file(source_path, ffmpeg_path, archive_config):
+    """
+    Transcode one recording to Opus and atomically replace it.
+
+    Returns:
+    --------
+    tuple
+        (bytes_before, bytes_after) of the swapped file
+    """
+    name, _ = os.path.splitext(source_path)
+    target_path = name + '.opus'
+    if os.path.exists(target_path):
+        target_path = f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.opus"
+    # Unique per transcoder, so two of them (e.g. hosts sharing the archive) can't
+    # write, or clean up, each other's output
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(source_path) or '.', suffix='.opus.partial')
+    os.close(fd)
+
+    command = [
+        ffmpeg_path, '-nostdin', '-loglevel', 'error', '-y',
+        '-i', source_path,
+        '-map_metadata', '0',
+        '-ac', '1',
+        '-c:a', 'libopus',
+        '-b:a', archive_config.get("bitrate", "24k"),
+        '-application', 'voip',
+        '-f', 'ogg',
+        temp_path,
+    ]
+
+    try:
+        run_yielding(command, archive_config.get("poll_seconds", 10))
+
+        # Never replace a recording with a truncated copy
+        source_duration = probe_duration(source_path, ffmpeg_path)
+        target_duration = probe_duration(temp_path, ffmpeg_path)
+        tolerance = archive_config.get("duration_tolerance_seconds", 0.5)
+        if abs(source_duration - target_duration) > tolerance:
+            raise RuntimeError(
+                f"duration mismatch: source {source_duration:.2f}s, opus {target_duration:.2f}s"
+            )
+
+        bytes_before = os.path.getsize(source_path)
+        bytes_after = os.path.getsize(temp_path)
+
+        os.replace(temp_path, target_path)
+        os.remove(source_path)
+        return bytes_before, bytes_after
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def transcode_archive(config, ffmpeg_path):
+    """Transcode every not-yet-compressed recording in the processed directory"""
+    processed_dir = config.get("processed_directory", "./processed_audio")
+    archive_config = config.get("archive", {})
+    poll_seconds = archive_config.get("poll_seconds", 10)
+
+    if not os.path.isdir(processed_dir):
+        logging.info(f"Processed directory {processed_dir} does not exist, nothing to transcode")
+        return
+
+    ledger_path = os.path.join(processed_dir, LEDGER_NAME)
+    ledger = load_ledger(ledger_path)
+
+    sources = sorted(
+        os.path.join(processed_dir, name) for name in os.listdir(processed_dir)
+        if name.lower().endswith(SOURCE_EXTENSIONS) and os.path.isfile(os.path.join(processed_dir, name))
+    )
+    logging.info(f"Found {len(sources)} recordings to transcode in {processed_dir}")
+
+    for source_path in sources:
+        wait_for_idle(poll_seconds)
+        try:
+            bytes_before, bytes_after = transcode_file(source_path, ffmpeg_path, archive_config)
+        except Exception as e:
+            logging.error(f"Failed to transcode {os.path.basename(source_path)}: {str(e)}")
+            continue
+
+        ledger["files"] += 1
+        ledger["bytes_before"] += bytes_before
+        ledger["bytes_after"] += bytes_after
+        ledger["bytes_saved"] += bytes_before - bytes_after
+        save_ledger(ledger_path, ledger)
+
+        logging.info(
+            f"Transcoded {os.path.basename(source_path)}: {bytes_before / 1e6:.1f} MB -> {bytes_after / 1e6:.1f} MB"
+        )
+
+    logging.info(
+        f"Archive transcoding done. Total saved so far: {ledger['bytes_saved'] / 1e6:.1f} MB "
+        f"across {ledger['files']} files"
+    )
+
+def main():
+    config_path = sys.argv[1] if len(sys.argv) > 1 else 'config.json'
+    # Same loader as local_whisper.py, so this host's overlay applies here too
+    config = load_config(config_path)
+
+    if not config.get("archive", {}).get("transcode_to_opus"):
+        logging.info("archive.transcode_to_opus is disabled in config, nothing to do")
+        return
+
+    lower_priority()
+    transcode_archive(config, setup_ffmpeg_path())
+
+if __name__ == "__main__":
+    main()
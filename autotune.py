@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Autotune - find the fastest transcription settings for this machine
+
+Sweeps torch CPU threads, beam settings and (with the lease queue enabled) the
+number of local workers on a small clip set, within a time limit. The profile
+with the best throughput is written to this host's config overlay,
+config.<hostname>.json, which load_config() merges over config.json:
+
+    python autotune.py --time-limit 900
+
+Each trial runs in fresh child processes so thread settings don't leak between
+trials; workers in a trial start transcribing together once all have loaded.
+Beam settings are only accepted when their transcripts agree closely enough
+with the ones produced by the settings in config.json.
+"""
+
+import argparse
+import difflib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from ffmpeg_utils import setup_ffmpeg_path, probe_duration
+
+ffmpeg_path = setup_ffmpeg_path()
+
+import torch
+import whisper
+from whisper.utils import optional_int
+
+from benchmark import make_synthetic_recording
+from local_whisper import (
+    build_decode_options, get_audio_files_from_directory, host_config_path,
+    load_config, load_local_model, merge_config, prepare_model
+)
+from speculative_decoding import install_speculative_decoding
+from streaming_audio import transcribe_streaming
+
+whisper.audio.FFMPEG_PATH = ffmpeg_path
+
+# (beam_size, best_of) pairs tried after the configured one, slowest first
+DECODING_CANDIDATES = [(5, 5), (3, 3), (2, 2), (None, 5), (None, 2)]
+
+
+def thread_candidates(cpu_count):
+    """Powers of two up to the number of CPUs, plus the CPU count itself."""
+    candidates = {cpu_count}
+    threads = 1
+    while threads < cpu_count:
+        candidates.add(threads)
+        threads *= 2
+    return sorted(candidates, reverse=True)
+
+
+def make_clip_set(config, directory, count, seconds):
+    """
+    Cut the first ``seconds`` of up to ``count`` local recordings into WAV clips,
+    or synthesize one clip if there are no recordings.
+
+    Returns:
+    --------
+    clips : list
+        Paths of the clips
+    audio_seconds : float
+        Their total duration
+    """
+    sources = []
+    for source_dir in (config.get("processed_directory", "./processed_audio"), config["downloads_directory"]):
+        if os.path.isdir(source_dir):
+            sources.extend(sorted(get_audio_files_from_directory(source_dir)))
+
+    clips = []
+    for i, source in enumerate(sources[:count]):
+        clip = os.path.join(directory, f"clip_{i}.wav")
+        subprocess.run(
+            [ffmpeg_path, "-nostdin", "-loglevel", "error", "-y", "-i", source,
+             "-t", str(seconds), "-ac", "1", "-ar", "16000", clip],
+            check=True,
+        )
+        clips.append(clip)
+
+    if not clips:
+        print("No local recordings found; tuning on a synthetic clip")
+        clip = os.path.join(directory, "synthetic.m4a")
+        make_synthetic_recording(clip, seconds / 60)
+        clips.append(clip)
+
+    return clips, sum(probe_duration(clip, ffmpeg_path) for clip in clips)
+
+
+def agreement(reference_texts, texts):
+    """Mean word-level similarity (0-1) between two lists of transcripts."""
+    ratios = [
+        difflib.SequenceMatcher(None, reference.split(), text.split()).ratio()
+        for reference, text in zip(reference_texts, texts)
+    ]
+    return sum(ratios) / len(ratios) if ratios else 1.0
+
+
+def run_trial(args, clips, audio_seconds, threads, workers, beam_size, best_of, time_left):
+    """
+    Transcribe the clip set in ``workers`` concurrent child processes.
+
+    Returns:
+    --------
+    trial : dict or None
+        Settings, throughput (audio seconds per second) and the first worker's
+        transcripts, or None if the trial failed or ran out of time
+    """
+    command = [
+        sys.executable, os.path.abspath(__file__), "--config", args.config, "--device", args.device,
+        "--child", "--threads", str(threads), "--beam-size", str(beam_size), "--best-of", str(best_of),
+    ] + clips
+    processes = [
+        subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, encoding="utf-8")
+        for _ in range(workers)
+    ]
+    # Kill the whole trial if it would overrun the time limit
+    timer = threading.Timer(time_left, lambda: [p.kill() for p in processes])
+    timer.start()
+
+    results = []
+    try:
+        # Start every worker at once, after all of them have loaded the model
+        for process in processes:
+            for line in process.stdout:
+                if line.startswith("READY"):
+                    break
+        for process in processes:
+            process.stdin.write("go\n")
+            process.stdin.flush()
+
+        for process in processes:
+            for line in process.stdout:
+                if line.startswith("RESULT "):
+                    results.append(json.loads(line[len("RESULT "):]))
+            process.wait()
+    except (BrokenPipeError, OSError):
+        pass
+    finally:
+        timer.cancel()
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+    if len(results) != workers:
+        return None
+
+    # Every worker transcribes the whole clip set, as if draining a shared backlog
+    wall_seconds = max(result["seconds"] for result in results)
+    return dict(
+        threads=threads,
+        workers=workers,
+        beam_size=beam_size,
+        best_of=best_of,
+        throughput=round(workers * audio_seconds / wall_seconds, 3),
+        texts=results[0]["texts"],
+    )
+
+
+def run_child(args, config):
+    """Load the model, wait for the parent's signal, then transcribe the clips and report."""
+    torch.set_num_threads(args.threads)
+
+    model_folder = config["model"]["folder"]
+    model_name = config["model"]["name"]
+    model = load_local_model(model_folder, model_name, args.device)
+    prepare_model(model, model_name, model_folder, args.device, config, verbose=False)
+
+    draft_name = config["model"].get("draft_name")
+    if draft_name:
+        draft_model = load_local_model(model_folder, draft_name, args.device)
+        install_speculative_decoding(model, draft_model, config["model"].get("draft_tokens", 4))
+
+    decode_options = build_decode_options(config, config["transcription"]["language"])
+    decode_options.update(beam_size=args.beam_size, best_of=args.best_of)
+    if args.device == "cpu":
+        decode_options["fp16"] = False
+    streaming_config = config.get("streaming", {})
+
+    print("READY", flush=True)
+    sys.stdin.readline()
+
+    start = time.perf_counter()
+    texts = []
+    for clip in args.clip_paths:
+        if streaming_config.get("enabled"):
+            result = transcribe_streaming(
+                model, clip, streaming_config.get("chunk_seconds", 60), ffmpeg_path, verbose=None, **decode_options
+            )
+        else:
+            result = whisper.transcribe(model, clip, verbose=None, **decode_options)
+        texts.append(result["text"])
+    seconds = time.perf_counter() - start
+
+    print("RESULT " + json.dumps({"seconds": seconds, "texts": texts}), flush=True)
+    return 0
+
+
+def describe(trial):
+    beam = f"beam {trial['beam_size']}" if trial["beam_size"] else "greedy"
+    return f"{trial['workers']} worker(s) x {trial['threads']} thread(s), {beam}, best_of {trial['best_of']}"
+
+
+def autotune(args, config):
+    cpu_count = os.cpu_count() or 1
+    deadline = time.monotonic() + args.time_limit
+    advanced_config = config["advanced"]
+    trials = []
+
+    def measure(threads, workers, beam_size, best_of):
+        time_left = deadline - time.monotonic()
+        if time_left <= 0:
+            return None
+        trial = run_trial(args, clips, audio_seconds, threads, workers, beam_size, best_of, time_left)
+        if trial is None:
+            print(f"  {threads} thread(s), {workers} worker(s): did not finish")
+            return None
+        trial["agreement"] = round(agreement(reference_texts or trial["texts"], trial["texts"]), 3)
+        trials.append(trial)
+        print(f"  {describe(trial)}: {trial['throughput']:.2f}x real time, agreement {trial['agreement']:.0%}")
+        return trial
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        clips, audio_seconds = make_clip_set(config, temp_dir, args.clips, args.clip_seconds)
+        print(f"Tuning on {len(clips)} clip(s), {audio_seconds:.0f}s of audio, "
+              f"{cpu_count} CPUs, time limit {args.time_limit}s")
+
+        # 1. Threads for a single worker, with the configured beam settings as the reference
+        reference_texts = None
+        beam_size, best_of = advanced_config["beam_size"], advanced_config["best_of"]
+        print("Threads:")
+        best = None
+        for threads in thread_candidates(cpu_count):
+            trial = measure(threads, 1, beam_size, best_of)
+            if trial is None:
+                break
+            if reference_texts is None:
+                reference_texts = trial["texts"]
+            if best is None or trial["throughput"] > best["throughput"]:
+                best = trial
+        if best is None:
+            print("No trial finished within the time limit; nothing to write")
+            return 1
+        baseline = trials[0]
+
+        # 2. Cheaper beam settings, as long as the transcripts stay close to the reference
+        print("Beam settings:")
+        for beam_size, best_of in DECODING_CANDIDATES:
+            if (beam_size, best_of) == (best["beam_size"], best["best_of"]):
+                continue
+            trial = measure(best["threads"], 1, beam_size, best_of)
+            if trial is None:
+                break
+            if trial["agreement"] >= args.min_agreement and trial["throughput"] > best["throughput"]:
+                best = trial
+
+        # 3. Local queue workers splitting the CPUs between them
+        if config.get("queue", {}).get("enabled"):
+            print("Workers:")
+            workers = 2
+            while workers <= cpu_count:
+                trial = measure(max(1, cpu_count // workers), workers, best["beam_size"], best["best_of"])
+                if trial is None or trial["throughput"] <= best["throughput"]:
+                    break
+                best = trial
+                workers *= 2
+        else:
+            print("Lease queue disabled; not tuning the number of workers")
+
+    print(f"Best: {describe(best)} at {best['throughput']:.2f}x real time "
+          f"({best['throughput'] / baseline['throughput']:.2f}x the first trial)")
+
+    profile = {
+        "advanced": {"threads": best["threads"], "beam_size": best["beam_size"], "best_of": best["best_of"]},
+        "autotune": {
+            "tuned_at": datetime.now().isoformat(timespec="seconds"),
+            "model": config["model"]["name"],
+            "device": args.device,
+            "throughput": best["throughput"],
+            "trials": [{k: v for k, v in trial.items() if k != "texts"} for trial in trials],
+        },
+    }
+    if config.get("queue", {}).get("enabled"):
+        profile["queue"] = {"workers": best["workers"]}
+
+    if args.dry_run:
+        print(json.dumps(profile, indent=2))
+        return 0
+
+    # Keep anything else already in the overlay
+    overlay_path = host_config_path(args.config)
+    overlay = {}
+    if os.path.isfile(overlay_path):
+        with open(overlay_path, "r", encoding="utf-8") as f:
+            overlay = json.load(f)
+    with open(overlay_path, "w", encoding="utf-8") as f:
+        json.dump(merge_config(overlay, profile), f, indent=2)
+    print(f"Saved settings for {socket.gethostname()} to {overlay_path}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find the fastest threads, workers and beam settings for this machine",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--config", type=str, default="config.json", help="path to the configuration file")
+    parser.add_argument("--device", default=None, help="device to tune for (defaults to the config's device)")
+    parser.add_argument("--time-limit", type=int, default=600, help="seconds the whole sweep may take")
+    parser.add_argument("--clips", type=int, default=3, help="number of local recordings to cut clips from")
+    parser.add_argument("--clip-seconds", type=int, default=60, help="length of each clip")
+    parser.add_argument("--min-agreement", type=float, default=0.9,
+                        help="minimum word-level similarity to the configured beam settings' transcripts")
+    parser.add_argument("--dry-run", action="store_true", help="print the profile instead of saving it")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--threads", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--beam-size", type=optional_int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--best-of", type=optional_int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("clip_paths", nargs="*", help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    # Tune against the shared settings, not a previous run's overlay...
+    config = load_config(args.config, host_overlay=False)
+    # ...but with the backends --calibrate recorded for this host
+    overlay_path = host_config_path(args.config)
+    if os.path.isfile(overlay_path):
+        with open(overlay_path, "r", encoding="utf-8") as f:
+            config["backend"] = merge_config(config.get("backend", {}), json.load(f).get("backend", {}))
+    args.device = args.device or config["device"]
+
+    sys.exit(run_child(args, config) if args.child else autotune(args, config))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the local transcription pipeline
+
+Each subcommand runs on CPU against checkpoints in the local ./model directory
+and prints its measurements to stdout:
+
+    python benchmark.py speculative --main small.pt --draft tiny.pt
+    python benchmark.py streaming --model tiny.pt --minutes 5 60
+    python benchmark.py kv-pool --model small.pt --beam-size 5 --files 3
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from ffmpeg_utils import setup_ffmpeg_path
+
+ffmpeg_path = setup_ffmpeg_path()
+
+import torch
+import whisper
+from whisper.decoding import DecodingOptions, PyTorchInference
+from whisper.tokenizer import get_tokenizer
+from whisper.utils import optional_int
+
+from kv_cache_pool import install_kv_pool
+from local_whisper import get_audio_files_from_directory, load_config, load_local_model
+from speculative_decoding import _IncrementalDecoder, install_speculative_decoding
+from streaming_audio import transcribe_streaming
+
+whisper.audio.FFMPEG_PATH = ffmpeg_path
+
+
+def default_clips(config, count):
+    """Pick up to ``count`` real recordings to benchmark on, preferring the processed archive."""
+    for directory in (config.get("processed_directory", "./processed_audio"), config["downloads_directory"]):
+        if os.path.isdir(directory):
+            audio_files = sorted(get_audio_files_from_directory(directory))
+            if audio_files:
+                return audio_files[:count]
+    print("No audio files found; pass one with --audio")
+    sys.exit(1)
+
+
+def default_clip(config):
+    """Pick a real recording to benchmark on, preferring the processed archive."""
+    return default_clips(config, 1)[0]
+
+
+def timed_transcribe(model, audio, language):
+    """Transcribe greedily on CPU and return (text, seconds)."""
+    start = time.perf_counter()
+    result = whisper.transcribe(
+        model=model,
+        audio=audio,
+        temperature=0,
+        language=language,
+        beam_size=None,
+        best_of=None,
+        fp16=False,
+        verbose=None,
+    )
+    return result["text"], time.perf_counter() - start
+
+
+def logit_drift(model, audio, language, n_tokens=64):
+    """
+    Compare the main model's logits on the first window computed Whisper's way, one
+    token per pass, with speculative verification's, all tokens in one pass.
+
+    Returns (largest absolute logit difference, positions whose argmax differs, positions compared).
+    """
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), model.dims.n_mels)
+    tokenizer = get_tokenizer(
+        model.is_multilingual, num_languages=model.num_languages, language=language, task="transcribe"
+    )
+    prefix = list(tokenizer.sot_sequence)
+
+    with torch.no_grad():
+        # Score the tokens Whisper itself picks for the window
+        generated = whisper.decode(model, mel, DecodingOptions(language=language, fp16=False)).tokens[:n_tokens]
+        tokens = torch.tensor([prefix + generated])
+        audio_features = model.embed_audio(mel.unsqueeze(0))
+
+        inference = PyTorchInference(model, len(prefix))
+        stock = torch.cat([
+            inference.logits(tokens[:, :length], audio_features)[:, -1]
+            for length in range(len(prefix), tokens.shape[1] + 1)
+        ]).float()
+        inference.cleanup_caching()
+
+        incremental = _IncrementalDecoder(model, audio_features)
+        verified = [incremental(tokens[:, :len(prefix)])[0, -1:]]
+        if generated:
+            verified.append(incremental(tokens[:, len(prefix):])[0])
+        verified = torch.cat(verified)
+
+    flips = int((stock.argmax(dim=-1) != verified.argmax(dim=-1)).sum())
+    return float((stock - verified).abs().max()), flips, stock.shape[0]
+
+
+def bench_speculative(args, config):
+    model_folder = config["model"]["folder"]
+    audio_paths = args.audio or default_clips(config, args.clips)
+
+    model = load_local_model(model_folder, args.main, "cpu")
+    draft_model = load_local_model(model_folder, args.draft, "cpu")
+
+    clips = []
+    for audio_path in audio_paths:
+        # Decode the audio file once up front so both runs measure transcription only
+        audio = whisper.load_audio(audio_path)
+
+        # Fix the language (this also warms the model up) so both runs decode the same prompt
+        language = args.language
+        if language is None:
+            mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), model.dims.n_mels)
+            _, probs = model.detect_language(mel)
+            language = max(probs, key=probs.get)
+
+        drift, flips, compared = logit_drift(model, audio, language)
+        baseline_text, baseline_time = timed_transcribe(model, audio, language)
+        clips.append(dict(
+            name=os.path.basename(audio_path), audio=audio, language=language, drift=drift, flips=flips,
+            compared=compared, baseline_text=baseline_text, baseline_time=baseline_time,
+        ))
+
+    stats = install_speculative_decoding(model, draft_model, args.draft_tokens)
+    for clip in clips:
+        clip["assisted_text"], clip["assisted_time"] = timed_transcribe(model, clip["audio"], clip["language"])
+
+    print(f"Baseline: {args.main}, assisted: {args.main} + {args.draft}")
+    print(f"{'clip':30} {'baseline s':>10} {'assisted s':>10} {'speedup':>8} {'max logit diff':>15} "
+          f"{'argmax flips':>13} {'identical':>9}")
+    for clip in clips:
+        print(f"{clip['name'][:30]:30} {clip['baseline_time']:10.2f} {clip['assisted_time']:10.2f} "
+              f"{clip['baseline_time'] / clip['assisted_time']:7.2f}x {clip['drift']:15.2e} "
+              f"{clip['flips']:>6}/{clip['compared']:<6} {str(clip['baseline_text'] == clip['assisted_text']):>9}")
+
+    baseline_time = sum(clip["baseline_time"] for clip in clips)
+    assisted_time = sum(clip["assisted_time"] for clip in clips)
+    identical = sum(clip["baseline_text"] == clip["assisted_text"] for clip in clips)
+    print(f"Speedup:                 {baseline_time / assisted_time:.2f}x")
+    print(f"Acceptance rate:         {stats.acceptance_rate:.1%} ({stats.accepted}/{stats.proposed})")
+    print(f"Tokens per main pass:    {stats.tokens_per_pass:.2f}")
+    print(f"Identical output:        {identical}/{len(clips)} clips")
+    if identical < len(clips) and not any(clip["flips"] for clip in clips):
+        print("Transcripts differ although no argmax flipped on the first windows; check the later windows")
+
+    return 0 if identical == len(clips) else 1
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (POSIX only)."""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def make_synthetic_recording(path, minutes):
+    """Write a compressed tone of the given length with FFmpeg."""
+    subprocess.run(
+        [
+            ffmpeg_path, "-nostdin", "-loglevel", "error", "-y",
+            "-f", "lavfi", "-i", f"sine=frequency=220:sample_rate=16000:duration={minutes * 60}",
+            "-ac", "1", "-c:a", "aac", "-b:a", "32k", path,
+        ],
+        check=True,
+    )
+
+
+def bench_streaming(args, config):
+    model_folder = config["model"]["folder"]
+
+    # Child mode: transcribe one file and report this process's peak RSS
+    if args.child_audio:
+        model = load_local_model(model_folder, args.model, "cpu")
+        options = dict(temperature=0, beam_size=None, best_of=None, fp16=False, language="en")
+        if args.mode == "stream":
+            transcribe_streaming(model, args.child_audio, args.chunk_seconds, ffmpeg_path, **options)
+        else:
+            whisper.transcribe(model, args.child_audio, **options)
+        print(f"PEAK_RSS_MB={peak_rss_mb():.1f}")
+        return 0
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for minutes in args.minutes:
+            audio = os.path.join(temp_dir, f"synthetic_{minutes}min.m4a")
+            make_synthetic_recording(audio, minutes)
+
+            for mode in args.modes:
+                child = subprocess.run(
+                    [
+                        sys.executable, os.path.abspath(__file__), "--config", args.config,
+                        "streaming", "--model", args.model, "--mode", mode,
+                        "--chunk-seconds", str(args.chunk_seconds), "--child-audio", audio,
+                    ],
+                    check=True, capture_output=True, text=True,
+                )
+                peak = float(child.stdout.rsplit("PEAK_RSS_MB=", 1)[1])
+                results[(mode, minutes)] = peak
+                print(f"{mode:>6} {minutes:>5} min: peak RSS {peak:8.1f} MB")
+
+    if "stream" not in args.modes or len(args.minutes) < 2:
+        return 0
+
+    # Streaming memory must not grow with the length of the recording
+    shortest, longest = min(args.minutes), max(args.minutes)
+    growth = results[("stream", longest)] / results[("stream", shortest)] - 1
+    print(f"Streaming RSS growth from {shortest} to {longest} min: {growth:+.1%} (tolerance {args.tolerance:.0%})")
+    return 0 if growth <= args.tolerance else 1
+
+
+def count_allocations(function):
+    """Run ``function`` under the profiler; return (result, allocations, bytes allocated)."""
+    from torch.profiler import ProfilerActivity, profile
+
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        result = function()
+    # Raw allocator records: positive sizes are allocations, negative ones frees
+    sizes = [event.nbytes() for event in prof.profiler.kineto_results.events() if event.name() == "[memory]"]
+    allocated = [size for size in sizes if size > 0]
+    return result, len(allocated), sum(allocated)
+
+
+def bench_kv_pool(args, config):
+    model_folder = config["model"]["folder"]
+    audio = args.audio or default_clip(config)
+
+    # Child mode: transcribe the clip --files times, then count one more file's allocations
+    if args.mode:
+        model = load_local_model(model_folder, args.model, "cpu")
+        pool = install_kv_pool(model, max(args.beam_size or 1, args.best_of or 1)) if args.mode == "pooled" else None
+        samples = whisper.load_audio(audio)[: int(args.seconds * whisper.audio.SAMPLE_RATE)]
+        options = dict(
+            language=args.language, beam_size=args.beam_size, best_of=args.best_of, fp16=False, verbose=None
+        )
+
+        def transcribe():
+            # Same seed in both modes so temperature fallback samples the same tokens
+            torch.manual_seed(0)
+            return whisper.transcribe(model, samples, **options)["text"]
+
+        start = time.perf_counter()
+        for _ in range(args.files):
+            text = transcribe()
+        seconds = (time.perf_counter() - start) / args.files
+        peak = peak_rss_mb()
+
+        _, allocations, allocated = count_allocations(transcribe)
+        print("RESULT " + json.dumps(dict(
+            seconds=seconds, peak_rss_mb=peak, allocations=allocations, allocated_mb=allocated / 1e6,
+            pool_mb=pool.nbytes / 1e6 if pool is not None else 0.0, text=text,
+        )))
+        return 0
+
+    print(f"Audio: {audio} (first {args.seconds}s), beam_size {args.beam_size}, best_of {args.best_of}")
+    results = {}
+    for mode in ("stock", "pooled"):
+        child = subprocess.run(
+            [
+                sys.executable, os.path.abspath(__file__), "--config", args.config, "--threads", str(args.threads),
+                "kv-pool", "--model", args.model, "--audio", audio, "--seconds", str(args.seconds),
+                "--files", str(args.files), "--beam-size", str(args.beam_size), "--best-of", str(args.best_of),
+                "--mode", mode,
+            ] + (["--language", args.language] if args.language else []),
+            check=True, capture_output=True, text=True,
+        )
+        results[mode] = json.loads(child.stdout.rsplit("RESULT ", 1)[1])
+
+    print(f"{'':8} {'s/file':>8} {'allocs/file':>12} {'MB alloc/file':>14} {'peak RSS MB':>12} {'pool MB':>8}")
+    for mode, r in results.items():
+        print(f"{mode:8} {r['seconds']:8.2f} {r['allocations']:12d} {r['allocated_mb']:14.1f} "
+              f"{r['peak_rss_mb']:12.1f} {r['pool_mb']:8.1f}")
+
+    stock, pooled = results["stock"], results["pooled"]
+    print(f"Allocations: {pooled['allocations'] / stock['allocations']:.1%} of stock, "
+          f"bytes allocated: {pooled['allocated_mb'] / stock['allocated_mb']:.1%} of stock")
+    print(f"Identical output:        {stock['text'] == pooled['text']}")
+    return 0 if stock["text"] == pooled["text"] else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the local transcription pipeline on CPU",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--config", type=str, default="config.json", help="path to the configuration file")
+    parser.add_argument("--threads", type=int, default=0, help="torch CPU threads (0 keeps the default)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    speculative = subparsers.add_parser("speculative", help="assisted generation with a draft model")
+    speculative.add_argument("--main", required=True, help="main model file in the model folder")
+    speculative.add_argument("--draft", required=True, help="draft model file in the model folder")
+    speculative.add_argument("--draft-tokens", type=int, default=4, help="tokens proposed per pass")
+    speculative.add_argument("--audio", nargs="+", default=None, help="audio files to transcribe")
+    speculative.add_argument("--clips", type=int, default=3, help="archived recordings to use without --audio")
+    speculative.add_argument("--language", default=None, help="skip language detection")
+    speculative.set_defaults(func=bench_speculative)
+
+    streaming = subparsers.add_parser("streaming", help="peak memory of streaming vs whole-file transcription")
+    streaming.add_argument("--model", required=True, help="model file in the model folder")
+    streaming.add_argument("--minutes", type=int, nargs="+", default=[5, 30], help="synthetic recording lengths")
+    streaming.add_argument("--modes", nargs="+", choices=["full", "stream"], default=["full", "stream"])
+    streaming.add_argument("--chunk-seconds", type=int, default=60, help="streaming chunk size")
+    streaming.add_argument("--tolerance", type=float, default=0.1, help="allowed streaming RSS growth")
+    streaming.add_argument("--mode", choices=["full", "stream"], default="stream", help=argparse.SUPPRESS)
+    streaming.add_argument("--child-audio", default=None, help=argparse.SUPPRESS)
+    streaming.set_defaults(func=bench_streaming)
+
+    kv_pool = subparsers.add_parser("kv-pool", help="allocations and peak memory with and without the KV cache pool")
+    kv_pool.add_argument("--model", required=True, help="model file in the model folder")
+    kv_pool.add_argument("--audio", default=None, help="audio file to transcribe")
+    kv_pool.add_argument("--seconds", type=float, default=120, help="use only the start of the audio")
+    kv_pool.add_argument("--files", type=int, default=3, help="times the clip is transcribed, like consecutive files")
+    kv_pool.add_argument("--beam-size", type=optional_int, default=5, help="beam size (None for greedy)")
+    kv_pool.add_argument("--best-of", type=optional_int, default=5, help="samples at non-zero temperature")
+    kv_pool.add_argument("--language", default=None, help="skip language detection")
+    kv_pool.add_argument("--mode", choices=["stock", "pooled"], default=None, help=argparse.SUPPRESS)
+    kv_pool.set_defaults(func=bench_kv_pool)
+
+    args = parser.parse_args()
+    config = load_config(args.config)
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    sys.exit(args.func(args, config))
+
+
+if __name__ == "__main__":
+    main()
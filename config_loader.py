@@ -0,0 +1,135 @@
+"""
+Config Loader - config.json plus this host's overlay
+
+load_config() reads the shared config.json (or built-in defaults when it is
+missing) and merges config.<hostname>.json over it, the overlay that autotune.py
+and `local_whisper.py --calibrate` write. It only needs the standard library, so
+lightweight background scripts such as archive_transcoder.py can use it without
+importing Whisper.
+"""
+
+import json
+import os
+import socket
+import sys
+
+def default_device():
+    """CUDA if PyTorch is installed and sees a GPU, else CPU"""
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def host_config_path(config_path="config.json"):
+    """Path of this host's config overlay, e.g. config.<hostname>.json next to config.json."""
+    root, ext = os.path.splitext(config_path)
+    return f"{root}.{socket.gethostname()}{ext or '.json'}"
+
+def merge_config(base, overlay):
+    """Recursively merge overlay into base; nested sections are merged, other values replaced."""
+    merged = dict(base)
+    for key, value in overlay.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def load_config(config_path="config.json", host_overlay=True):
+    """Load configuration from a JSON file, merged with this host's overlay if there is one."""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        print(f"Loaded configuration from {config_path}")
+    except FileNotFoundError:
+        print(f"Configuration file {config_path} not found. Using default settings.")
+        # Use a default configuration
+        config = {
+            "downloads_directory": "./downloads",
+            "output_file": "250321_daily.txt",
+            "processed_directory": "./processed_audio",
+            "model": {
+                "folder": "./model",
+                "name": "my_model.pt",
+                "draft_name": None,
+                "draft_tokens": 4
+            },
+            "transcription": {
+                "task": "transcribe",
+                "language": None,
+                "temperature": 0,
+                "word_timestamps": False
+            },
+            "advanced": {
+                "best_of": 5,
+                "beam_size": 5,
+                "patience": None,
+                "length_penalty": None,
+                "suppress_tokens": "-1",
+                "initial_prompt": None,
+                "condition_on_previous_text": True,
+                "fp16": True,
+                "threads": 0
+            },
+            "streaming": {
+                "enabled": False,
+                "chunk_seconds": 60
+            },
+            "backend": {
+                "encoder": "eager",
+                "decoder": "eager"
+            },
+            "queue": {
+                "enabled": False,
+                "workers": 1,
+                "lease_seconds": 120,
+                "heartbeat_seconds": 30
+            },
+            "archive": {
+                "transcode_to_opus": False,
+                "bitrate": "24k",
+                "duration_tolerance_seconds": 0.5,
+                "poll_seconds": 10
+            },
+            "repetition_guard": {
+                "enabled": False,
+                "max_ngram": 8,
+                "min_repeats": 4,
+                "min_span_tokens": 16,
+                "action": "fallback"
+            },
+            "routing": {
+                "enabled": False,
+                "memory_budget_mb": 4096,
+                "language_model": None,
+                "rules": []
+            },
+            "deadline": {
+                "enabled": False,
+                "budget_seconds": 3300,
+                "margin": 0.9,
+                "assumed_rtf": 0.5,
+                "levels": []
+            },
+            "kv_pool": {
+                "enabled": False
+            },
+            "verbose": True,
+            "device": default_device()
+        }
+    except json.JSONDecodeError:
+        print(f"Error parsing {config_path}. Using default settings.")
+        sys.exit(1)
+    
+    # Settings tuned for this machine (see autotune.py) override the shared ones
+    overlay_path = host_config_path(config_path)
+    if host_overlay and os.path.isfile(overlay_path):
+        try:
+            with open(overlay_path, 'r', encoding='utf-8') as f:
+                config = merge_config(config, json.load(f))
+            print(f"Applied host settings from {overlay_path}")
+        except json.JSONDecodeError:
+            print(f"Error parsing {overlay_path}. Ignoring host settings.")
+    
+    return config
@@ -0,0 +1,142 @@
+"""
+Cycle Deadline
+
+Keeps a transcription run within the scheduler's cycle so a spike in uploads
+cannot make the backlog grow from one cycle to the next.
+
+- scheduler.py passes the cycle's deadline to local_whisper.py in the
+  PIPELINE_CYCLE_DEADLINE environment variable (a Unix timestamp); run by hand,
+  local_whisper.py uses deadline.budget_seconds from its start instead
+- Before each file, DeadlinePlanner projects the time the queued audio needs from
+  the measured real-time factor (RTF, transcription seconds per audio second) and
+  picks the most expensive settings level that still finishes in time: full
+  quality, then each cheaper level from deadline.levels in turn (for example
+  greedy decoding, then a smaller model without word timestamps)
+- Files transcribed below full quality are appended to degraded_files.jsonl, and
+  `local_whisper.py --reprocess-degraded` re-transcribes them at full quality
+  when the machine is idle
+"""
+
+import json
+import os
+import time
+
+from ffmpeg_utils import probe_duration
+
+DEADLINE_ENV = 'PIPELINE_CYCLE_DEADLINE'
+DEGRADED_LOG = 'degraded_files.jsonl'
+# Weight of the newest file in a level's moving-average RTF
+RTF_SMOOTHING = 0.3
+# Keys of a level that are not whisper.transcribe options
+LEVEL_KEYS = ('name', 'model', 'speedup')
+
+def cycle_deadline(budget_seconds, started=None):
+    """The scheduler's deadline for this cycle if it passed one, else ``budget_seconds`` from ``started``"""
+    value = os.environ.get(DEADLINE_ENV)
+    if value:
+        return float(value)
+    return (started if started is not None else time.time()) + budget_seconds
+
+def queued_audio_seconds(audio_paths, durations, ffmpeg_path='ffmpeg'):
+    """Total duration of the given files; ``durations`` caches ffprobe results across calls"""
+    total = 0.0
+    for audio_path in audio_paths:
+        if audio_path not in durations:
+            try:
+                durations[audio_path] = probe_duration(audio_path, ffmpeg_path)
+            except Exception:
+                durations[audio_path] = None
+        total += durations[audio_path] or 0.0
+    return total
+
+def level_options(level):
+    """The whisper.transcribe options a settings level overrides"""
+    return {key: value for key, value in level.items() if key not in LEVEL_KEYS}
+
+class DeadlinePlanner:
+    """
+    Choose per file how much decoding cost the remaining time allows.
+
+    Parameters:
+    -----------
+    deadline : float
+        Unix time the run should be finished by
+    levels : list
+        Cheaper settings in the order they are stepped down to. Each level is a
+        dict with a "name", optionally a "model" from the model folder, any
+        whisper.transcribe options to override, and a "speedup" over full
+        quality assumed until the level has been measured
+    assumed_rtf : float
+        Full-quality RTF assumed until the first file has been measured
+    margin : float
+        Fraction of the remaining time that may be planned, the rest is slack
+    """
+
+    def __init__(self, deadline, levels, assumed_rtf=0.5, margin=0.9):
+        self.deadline = deadline
+        self.levels = [{"name": "full"}] + list(levels)
+        self.assumed_rtf = assumed_rtf
+        self.margin = margin
+        self.rtf = [None] * len(self.levels)
+
+    def time_left(self, now=None):
+        """Seconds that may still be planned before the deadline"""
+        return max(0.0, (self.deadline - (now if now is not None else time.time())) * self.margin)
+
+    def estimated_rtf(self, level):
+        if self.rtf[level] is not None:
+            return self.rtf[level]
+        full_rtf = self.rtf[0] if self.rtf[0] is not None else self.assumed_rtf
+        return full_rtf / self.levels[level].get("speedup", 1.0)
+
+    def fits(self, audio_seconds, level=0, now=None):
+        """Whether ``audio_seconds`` of audio at ``level`` is projected to finish before the deadline"""
+        return audio_seconds * self.estimated_rtf(level) <= self.time_left(now)
+
+    def choose(self, remaining_audio_seconds, now=None):
+        """Index of the most expensive level projected to finish the remaining audio in time"""
+        for level in range(len(self.levels)):
+            if self.fits(remaining_audio_seconds, level, now):
+                return level
+        # Even the cheapest level misses; it still gets closest
+        return len(self.levels) - 1
+
+    def remove_level(self, level):
+        """Stop choosing a cheaper level, e.g. because its model cannot be loaded"""
+        if level:
+            del self.levels[level]
+            del self.rtf[level]
+
+    def record(self, level, audio_seconds, seconds):
+        """Fold a transcribed file's measured RTF into the level's moving average"""
+        if not audio_seconds:
+            return
+        rtf = seconds / audio_seconds
+        previous = self.rtf[level]
+        self.rtf[level] = rtf if previous is None else (1 - RTF_SMOOTHING) * previous + RTF_SMOOTHING * rtf
+
+def log_degraded(entries, degraded_log=DEGRADED_LOG):
+    """Append files transcribed below full quality to the degraded log"""
+    with open(degraded_log, 'a', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+
+def load_degraded(degraded_log=DEGRADED_LOG):
+    """Entries of the degraded log, oldest first"""
+    entries = []
+    try:
+        with open(degraded_log, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entries.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+    return entries
+
+def save_degraded(entries, degraded_log=DEGRADED_LOG):
+    """Atomically replace the degraded log with ``entries``"""
+    temp_path = degraded_log + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+    os.replace(temp_path, degraded_log)
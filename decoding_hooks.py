@@ -0,0 +1,58 @@
+"""
+Decoding Hooks - per-model customisation of Whisper's decoding step
+
+whisper.transcribe decodes every 30-second window through ``model.decode``.
+install_decoding_hooks() routes that call through decode() below, which builds
+the DecodingTask from a per-model DecodingSetup. Features can then change the
+task class, adjust each task after construction or post-process its results,
+and combine with each other instead of each replacing ``model.decode``.
+"""
+
+import functools
+from dataclasses import dataclass, field, replace
+from typing import Callable, List
+
+import torch
+
+from whisper.decoding import DecodingOptions, DecodingTask
+
+
+@dataclass
+class DecodingSetup:
+    """How decode() builds and runs the DecodingTask for one model."""
+    task_class: type = DecodingTask
+    task_kwargs: dict = field(default_factory=dict)
+    # Called as hook(task) right after the task is constructed
+    task_hooks: List[Callable] = field(default_factory=list)
+    # Called as hook(task, results) and must return the (possibly replaced) results
+    result_hooks: List[Callable] = field(default_factory=list)
+
+
+@torch.no_grad()
+def decode(model, mel, options=DecodingOptions(), *, setup, **kwargs):
+    """Drop-in replacement for whisper.decoding.decode driven by a DecodingSetup."""
+    if single := mel.ndim == 2:
+        mel = mel.unsqueeze(0)
+
+    if kwargs:
+        options = replace(options, **kwargs)
+
+    task = setup.task_class(model, options, **setup.task_kwargs)
+    for hook in setup.task_hooks:
+        hook(task)
+
+    result = task.run(mel)
+    for hook in setup.result_hooks:
+        result = hook(task, result)
+
+    return result[0] if single else result
+
+
+def install_decoding_hooks(model):
+    """Route ``model.decode`` through decode() and return the model's DecodingSetup."""
+    setup = getattr(model, "decoding_setup", None)
+    if setup is None:
+        setup = DecodingSetup()
+        model.decoding_setup = setup
+        model.decode = functools.partial(decode, model, setup=setup)
+    return setup
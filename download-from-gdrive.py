@@ -1,19 +1,26 @@
 import os
 import io
+import json
+import hashlib
 import pickle
 import sys
+from google.auth.credentials import AnonymousCredentials
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
+from pipeline_timing import record_download
+from download_manifest import MANIFEST_NAME, load_manifest, save_manifest, record_file, find_local_copy
 
 # Set stdout to use utf-8 encoding
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', line_buffering=True)
 
 # If modifying these scopes, delete the token.pickle file
 SCOPES = ['https://www.googleapis.com/auth/drive']  # Changed to full access for deletion
 CREDENTIALS_FILE = 'credentials.json'
 FOLDER_NAME = 'a-daily-log'  # Your Google Drive folder name
+# Talk to a Drive-compatible server instead of Google (e.g. load_test.py's fake Drive), without OAuth
+API_ENDPOINT = os.environ.get('GDRIVE_API_ENDPOINT')
 
 def check_credentials_file():
     """Check if credentials.json exists and provide help if not."""
@@ -63,6 +70,16 @@ def authenticate_google_drive():
             
     return creds
 
+def build_drive_service():
+    """Build the Drive API client, for GDRIVE_API_ENDPOINT if it is set."""
+    if API_ENDPOINT:
+        print(f"Using Drive API endpoint {API_ENDPOINT}")
+        return build('drive', 'v3', credentials=AnonymousCredentials(),
+                     client_options={'api_endpoint': API_ENDPOINT}, cache_discovery=False)
+    
+    creds = authenticate_google_drive()
+    return build('drive', 'v3', credentials=creds)
+
 def find_folder_by_name(service, folder_name):
     """Find a folder by name in Google Drive."""
     # Search for folders with the given name
@@ -102,13 +119,21 @@ def find_file_by_name_in_folder(service, file_name, folder_id):
 def list_files_in_folder(service, folder_id):
     """List all files in a specific Google Drive folder."""
     query = f"'{folder_id}' in parents and trashed = false"
-    results = service.files().list(
-        q=query,
-        spaces='drive',
-        fields='files(id, name, mimeType)'
-    ).execute()
+    files = []
+    page_token = None
     
-    return results.get('files', [])
+    # Drive returns at most one page (100 files by default) per request
+    while True:
+        results = service.files().list(
+            q=query,
+            spaces='drive',
+            fields='nextPageToken, files(id, name, mimeType, createdTime, md5Checksum, size)',
+            pageToken=page_token
+        ).execute()
+        files.extend(results.get('files', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return files
 
 def download_file(service, file_id, file_name):
     """Download a file from Google Drive."""
@@ -124,10 +149,11 @@ def download_file(service, file_id, file_name):
         status, done = downloader.next_chunk()
         print(f"Download progress: {int(status.progress() * 100)}%")
     
-    # Save the file
+    # Save the file under a temporary name first, so it never appears half written
     file_stream.seek(0)
-    with open(file_name, 'wb') as f:
+    with open(file_name + '.part', 'wb') as f:
         f.write(file_stream.read())
+    os.replace(file_name + '.part', file_name)
     
     print(f"File '{file_name}' downloaded successfully!")
 
@@ -141,8 +167,21 @@ def delete_file(service, file_id, file_name):
         print(f"Error deleting file '{file_name}': {str(e)}")
         return False
 
+def get_processed_directory():
+    """Read processed_directory from config.json, falling back to the default"""
+    try:
+        with open('config.json', 'r', encoding='utf-8') as f:
+            return json.load(f).get('processed_directory', './processed_audio')
+    except (OSError, json.JSONDecodeError):
+        return './processed_audio'
+
 def download_all_files(service, files):
-    """Download all files from the list."""
+    """
+    Download all files from the list, skipping files whose bytes are already on disk.
+    
+    Returns the files that are safely stored locally (downloaded now or found
+    already present), i.e. the ones that may be deleted from Google Drive.
+    """
     print(f"\nDownloading all {len(files)} files from folder...")
     
     # Create a downloads directory if it doesn't exist
@@ -151,6 +190,13 @@ def download_all_files(service, files):
         os.makedirs(download_dir)
         print(f"Created directory: {download_dir}")
     
+    # Files already downloaded, waiting for transcription or archived are not fetched again
+    manifest_path = os.path.join(download_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    local_directories = [download_dir, get_processed_directory()]
+    skipped_count = 0
+    bytes_avoided = 0
+    
     # Keep track of successfully downloaded files
     downloaded_files = []
     
@@ -165,6 +211,15 @@ def download_all_files(service, files):
             print(f"Skipping Google Workspace file: {file_name} (requires export)")
             continue
         
+        # Already on disk (e.g. deleting it from Drive failed last cycle): only retry the delete
+        local_copy = find_local_copy(manifest, file, local_directories)
+        if local_copy:
+            print(f"\nSkipping file {i}/{len(files)}: {file_name} (already on disk as '{local_copy}')")
+            skipped_count += 1
+            bytes_avoided += int(file.get('size', 0))
+            downloaded_files.append(file)
+            continue
+        
         # Create path for downloaded file
         file_path = os.path.join(download_dir, file_name)
         
@@ -183,17 +238,34 @@ def download_all_files(service, files):
                 status, done = downloader.next_chunk()
                 print(f"Download progress: {int(status.progress() * 100)}%")
             
-            # Save the file
-            file_stream.seek(0)
-            with open(file_path, 'wb') as f:
-                f.write(file_stream.read())
+            # Never delete the Drive copy of a download that arrived corrupted
+            data = file_stream.getvalue()
+            if file.get('md5Checksum') and hashlib.md5(data).hexdigest() != file['md5Checksum']:
+                raise ValueError("checksum mismatch, the download is incomplete or corrupted")
+            
+            # Save the file under a temporary name first: transcription workers on
+            # other hosts may claim anything in the shared downloads directory
+            temp_path = file_path + '.part'
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, file_path)
+            
+            # Remember upload and download times for end-to-end latency tracking
+            record_download(file_path, file.get('createdTime'))
+            if file.get('md5Checksum'):
+                record_file(manifest, file, file_path)
             
             print(f"File '{file_name}' downloaded successfully!")
             downloaded_files.append(file)
         except Exception as e:
             print(f"Error downloading '{file_name}': {str(e)}")
     
+    manifest["bytes_avoided"] += bytes_avoided
+    save_manifest(manifest_path, manifest)
+    
     print(f"\nDownload complete! All files saved to the '{download_dir}' directory.")
+    print(f"Skipped {skipped_count} files already on disk, avoiding {bytes_avoided / 1e6:.1f} MB of downloads "
+          f"this cycle ({manifest['bytes_avoided'] / 1e6:.1f} MB in total)")
     return downloaded_files
 
 def delete_files_without_confirmation(service, downloaded_files):
@@ -218,8 +290,7 @@ def main():
     print(f"Authenticating with Google Drive...")
     
     try:
-        creds = authenticate_google_drive()
-        service = build('drive', 'v3', credentials=creds)
+        service = build_drive_service()
         
         # Find the 'a-daily-log' folder
         print(f"Searching for folder: {FOLDER_NAME}")
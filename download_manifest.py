@@ -0,0 +1,94 @@
+"""
+Download Manifest
+
+Remembers which Google Drive files are already on disk so download-from-gdrive.py
+never fetches the same bytes twice, e.g. when deleting a file from Drive failed
+after it was downloaded, or when a recording is already waiting in downloads/
+or archived in processed_audio/.
+
+- Every verified download is recorded under its Drive md5Checksum in
+  downloads/.download_manifest.json
+- A Drive file counts as present when a local copy with the same name (or the
+  _YYYYMMDD_HHMMSS name local_whisper.py gives duplicates) matches its size and
+  md5, or when the manifest has its md5 and archive_transcoder.py has replaced
+  the copy with an .opus file, which can no longer be hashed against Drive
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+
+MANIFEST_NAME = '.download_manifest.json'
+
+def file_md5(file_path, chunk_size=1024 * 1024):
+    """MD5 hex digest of a file, read in chunks"""
+    digest = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"files": {}, "bytes_avoided": 0}
+
+def save_manifest(manifest_path, manifest):
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, manifest_path)
+
+def record_file(manifest, drive_file, file_path):
+    """Remember that a Drive file's bytes are on disk at file_path"""
+    manifest["files"][drive_file['md5Checksum']] = {
+        "name": drive_file['name'],
+        "drive_id": drive_file['id'],
+        "size": int(drive_file.get('size', 0)),
+        "path": file_path,
+        "recorded": time.time(),
+    }
+
+def _local_candidates(file_name, directories):
+    """Files in directories that may be a copy of file_name, including renamed and .opus copies"""
+    stem, ext = os.path.splitext(file_name)
+    pattern = re.compile(
+        re.escape(stem) + r'(_\d{8}_\d{6})*(' + re.escape(ext) + r'|\.opus)$', re.IGNORECASE
+    )
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if pattern.match(name):
+                yield os.path.join(directory, name)
+
+def find_local_copy(manifest, drive_file, directories):
+    """
+    Return the path of a verified local copy of a Drive file, or None.
+
+    Files without an md5Checksum (which Drive only omits for non-binary
+    content) are never considered present.
+    """
+    md5 = drive_file.get('md5Checksum')
+    if not md5:
+        return None
+    size = int(drive_file['size']) if 'size' in drive_file else None
+    known = md5 in manifest["files"]
+
+    transcoded = not drive_file['name'].lower().endswith('.opus')
+    for path in _local_candidates(drive_file['name'], directories):
+        if transcoded and path.lower().endswith('.opus'):
+            if known:
+                return path
+            continue
+        if size is not None and os.path.getsize(path) != size:
+            continue
+        if file_md5(path) == md5:
+            if not known:
+                record_file(manifest, drive_file, path)
+            return path
+    return None
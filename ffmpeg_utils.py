@@ -1,4 +1,5 @@
 import os
+import subprocess
 import sys
 
 def setup_ffmpeg_path():
@@ -16,4 +17,24 @@ def setup_ffmpeg_path():
     else:
         # Running as script, assume FFmpeg is in PATH
         print("Using system FFmpeg")
-        return 'ffmpeg' 
\ No newline at end of file
+        return 'ffmpeg'
+
+def ffprobe_path_for(ffmpeg_path):
+    """Return the ffprobe executable that sits next to the given FFmpeg executable"""
+    directory, name = os.path.split(ffmpeg_path)
+    return os.path.join(directory, name.replace('ffmpeg', 'ffprobe'))
+
+def probe_duration(file_path, ffmpeg_path='ffmpeg'):
+    """Return the duration of an audio file in seconds, as reported by ffprobe"""
+    result = subprocess.run(
+        [
+            ffprobe_path_for(ffmpeg_path), '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1',
+            file_path,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(result.stdout.strip())
@@ -0,0 +1,269 @@
+"""
+Inference Backends - alternative runtimes for the local Whisper model
+
+The encoder can run through eager PyTorch, torch.compile, a TorchScript trace or
+ONNX Runtime (CPU). The decoder, which relies on forward hooks for its key/value
+cache, can run eagerly or through torch.compile. Traced/exported artifacts and
+the torch.compile cache live next to the checkpoints in the model folder.
+
+calibrate_backends() times every backend available on this host on a short
+synthetic clip so the fastest one can be recorded in the host's config overlay
+(config.<hostname>.json), which load_config() merges over config.json.
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+
+import torch
+from torch import nn
+
+from whisper.audio import N_FRAMES, N_SAMPLES, SAMPLE_RATE, log_mel_spectrogram
+from whisper.decoding import DecodingOptions, decode
+
+ENCODER_BACKENDS = ("eager", "compile", "torchscript", "onnx")
+DECODER_BACKENDS = ("eager", "compile")
+
+
+class _Float32Encoder(nn.Module):
+    """Run a traced/exported encoder in float32 and hand back the caller's dtype."""
+
+    def __init__(self, encoder):
+        super().__init__()
+        self.encoder = encoder
+
+    def forward(self, mel):
+        return self.encoder(mel.float()).to(mel.dtype)
+
+
+class _OnnxEncoder(nn.Module):
+    """Adapter exposing an ONNX Runtime session as a torch encoder module."""
+
+    def __init__(self, onnx_path):
+        super().__init__()
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward(self, mel):
+        (audio_features,) = self.session.run(None, {self.input_name: mel.float().cpu().numpy()})
+        return torch.from_numpy(audio_features).to(device=mel.device, dtype=mel.dtype)
+
+
+def available_backends(device):
+    """Return the (encoder, decoder) backends usable on this host and device."""
+    encoder, decoder = ["eager", "torchscript"], ["eager"]
+
+    if hasattr(torch, "compile"):
+        encoder.append("compile")
+        decoder.append("compile")
+
+    if device == "cpu":
+        try:
+            import onnxruntime  # noqa: F401
+            encoder.append("onnx")
+        except ImportError:
+            pass
+
+    return encoder, decoder
+
+
+def _artifact_path(model_folder, model_name, suffix):
+    return os.path.join(model_folder, f"{os.path.splitext(model_name)[0]}.encoder.{suffix}")
+
+
+def _is_fresh(artifact_path, checkpoint_path):
+    """An artifact is reusable only if it was built after the checkpoint last changed."""
+    return (
+        os.path.isfile(artifact_path)
+        and os.path.getmtime(artifact_path) >= os.path.getmtime(checkpoint_path)
+    )
+
+
+def _example_mel(model, device):
+    return torch.zeros(1, model.dims.n_mels, N_FRAMES, device=device)
+
+
+def build_encoder(model, backend, model_folder, model_name, device):
+    """
+    Build an encoder module for ``backend``, reusing cached artifacts from the model folder.
+
+    Parameters:
+    -----------
+    model : whisper.model.Whisper
+        The loaded model; its eager encoder is used to trace/export
+    backend : str
+        One of ENCODER_BACKENDS
+    model_folder : str
+        Folder holding the checkpoint and its cached artifacts
+    model_name : str
+        Checkpoint file name, used to name the artifacts
+    device : str
+        The device the model runs on
+
+    Returns:
+    --------
+    torch.nn.Module
+        A module that maps a mel batch to audio features
+    """
+    eager_encoder = model.encoder
+    checkpoint_path = os.path.join(model_folder, model_name)
+
+    if backend == "eager":
+        return eager_encoder
+
+    if backend == "compile":
+        # Keep inductor's compiled kernels with the checkpoints instead of /tmp
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(model_folder, "torch_compile_cache"))
+        return torch.compile(eager_encoder)
+
+    if backend == "torchscript":
+        ts_path = _artifact_path(model_folder, model_name, f"{device}.ts")
+        if _is_fresh(ts_path, checkpoint_path):
+            traced = torch.jit.load(ts_path, map_location=device)
+        else:
+            print(f"Tracing encoder to {ts_path}")
+            with torch.no_grad():
+                traced = torch.jit.trace(eager_encoder.float(), _example_mel(model, device))
+            torch.jit.save(traced, ts_path)
+        return _Float32Encoder(traced)
+
+    if backend == "onnx":
+        onnx_path = _artifact_path(model_folder, model_name, "onnx")
+        if not _is_fresh(onnx_path, checkpoint_path):
+            print(f"Exporting encoder to {onnx_path}")
+            with torch.no_grad():
+                torch.onnx.export(
+                    eager_encoder.float().cpu(),
+                    _example_mel(model, "cpu"),
+                    onnx_path,
+                    input_names=["mel"],
+                    output_names=["audio_features"],
+                    dynamic_axes={"mel": {0: "batch"}, "audio_features": {0: "batch"}},
+                    opset_version=17,
+                )
+            eager_encoder.to(device)
+        return _OnnxEncoder(onnx_path)
+
+    raise ValueError(f"Unknown encoder backend '{backend}'. Choose from: {', '.join(ENCODER_BACKENDS)}")
+
+
+def build_decoder(model, backend, model_folder):
+    """Return the text decoder for ``backend`` (eager or torch.compile)."""
+    if backend == "eager":
+        return model.decoder
+
+    if backend == "compile":
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(model_folder, "torch_compile_cache"))
+        # The token dimension grows on every step, so compile for dynamic shapes
+        return torch.compile(model.decoder, dynamic=True)
+
+    raise ValueError(f"Unknown decoder backend '{backend}'. Choose from: {', '.join(DECODER_BACKENDS)}")
+
+
+def apply_backends(model, encoder_backend, decoder_backend, model_folder, model_name, device):
+    """Swap the model's encoder/decoder for the requested backends in place."""
+    # Build both before swapping so a failure leaves the model fully eager
+    encoder = build_encoder(model, encoder_backend, model_folder, model_name, device)
+    decoder = build_decoder(model, decoder_backend, model_folder)
+    model.encoder, model.decoder = encoder, decoder
+    return model
+
+
+def resolve_backends(config):
+    """
+    Pick the backends to use from config. A calibration recorded for this host
+    is already merged in from its config overlay.
+    """
+    backend_config = config.get("backend", {})
+    return backend_config.get("encoder", "eager"), backend_config.get("decoder", "eager")
+
+
+def _synthetic_mel(model, device, seconds):
+    """Log-mel spectrogram of a quiet noise clip, padded to one 30-second window."""
+    generator = torch.Generator().manual_seed(0)
+    audio = 0.01 * torch.randn(int(seconds * SAMPLE_RATE), generator=generator)
+    mel = log_mel_spectrogram(audio, model.dims.n_mels, padding=N_SAMPLES)[:, :N_FRAMES]
+    return mel.unsqueeze(0).to(device)
+
+
+def _time_call(function, repeats):
+    """Median wall time of ``function`` after one warm-up call (which also compiles)."""
+    function()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def calibrate_backends(model, model_folder, model_name, device, clip_seconds=5, repeats=3, verbose=True):
+    """
+    Time every available backend on a synthetic clip.
+
+    Returns:
+    --------
+    dict
+        Fastest encoder and decoder backends, their timings and when they were measured
+    """
+    encoder_backends, decoder_backends = available_backends(device)
+    mel = _synthetic_mel(model, device, clip_seconds)
+    eager_encoder, eager_decoder = model.encoder, model.decoder
+    # Cap the decode length so a hallucinating clip cannot dominate the calibration
+    options = DecodingOptions(language="en", without_timestamps=True, fp16=False, sample_len=32)
+
+    encoder_timings, decoder_timings = {}, {}
+    try:
+        with torch.no_grad():
+            for backend in encoder_backends:
+                try:
+                    model.encoder = build_encoder(model, backend, model_folder, model_name, device)
+                    encoder_timings[backend] = _time_call(lambda: model.embed_audio(mel), repeats)
+                except Exception as e:
+                    print(f"Encoder backend '{backend}' unavailable: {str(e)}")
+                finally:
+                    model.encoder = eager_encoder
+                if verbose and backend in encoder_timings:
+                    print(f"  encoder {backend:<12} {encoder_timings[backend] * 1000:8.1f} ms")
+
+            audio_features = model.embed_audio(mel)
+            for backend in decoder_backends:
+                try:
+                    model.decoder = build_decoder(model, backend, model_folder)
+                    decoder_timings[backend] = _time_call(lambda: decode(model, audio_features, options), repeats)
+                except Exception as e:
+                    print(f"Decoder backend '{backend}' unavailable: {str(e)}")
+                finally:
+                    model.decoder = eager_decoder
+                if verbose and backend in decoder_timings:
+                    print(f"  decoder {backend:<12} {decoder_timings[backend] * 1000:8.1f} ms")
+    finally:
+        model.encoder, model.decoder = eager_encoder, eager_decoder
+
+    return {
+        "encoder": min(encoder_timings, key=encoder_timings.get, default="eager"),
+        "decoder": min(decoder_timings, key=decoder_timings.get, default="eager"),
+        "timings_ms": {
+            "encoder": {name: round(seconds * 1000, 1) for name, seconds in encoder_timings.items()},
+            "decoder": {name: round(seconds * 1000, 1) for name, seconds in decoder_timings.items()},
+        },
+        "model": model_name,
+        "device": device,
+        "calibrated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def record_calibration(overlay_path, calibration):
+    """Store ``calibration`` in the backend section of this host's config overlay, keeping its other settings."""
+    try:
+        with open(overlay_path, "r", encoding="utf-8") as f:
+            overlay = json.load(f)
+    except FileNotFoundError:
+        overlay = {}
+
+    overlay.setdefault("backend", {}).update(calibration)
+    with open(overlay_path, "w", encoding="utf-8") as f:
+        json.dump(overlay, f, indent=2)
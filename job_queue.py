@@ -0,0 +1,217 @@
+"""
+Job Queue - lease-based work distribution over a shared downloads directory
+
+Several transcription workers (processes or hosts) can drain the same
+downloads_directory. A worker claims an audio file by creating
+``.leases/<file name>.lease`` with O_CREAT | O_EXCL, which succeeds for exactly
+one worker, and keeps the lease alive by touching it from a heartbeat thread.
+A lease whose heartbeat is older than ``lease_seconds`` belongs to a dead worker:
+the next worker that sees it breaks it and takes the file over. Lease age is
+measured against the file server's clock, not the local one, so hosts whose
+clocks disagree don't break each other's live leases.
+
+Only plain files and atomic renames are used, so this works on network shares
+where SQLite locking is unreliable.
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+
+LEASE_DIRECTORY = ".leases"
+
+
+def default_worker_id():
+    """hostname:pid plus a random suffix, unique across hosts and restarts."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Lease:
+    """A claimed audio file, kept alive by a background heartbeat until released."""
+
+    def __init__(self, audio_path, lease_path, worker_id, heartbeat_seconds):
+        self.audio_path = audio_path
+        self.lease_path = lease_path
+        self.worker_id = worker_id
+        self.lost = False
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(
+            target=self._beat, args=(heartbeat_seconds,), name=f"lease-heartbeat-{os.path.basename(audio_path)}",
+            daemon=True,
+        )
+        self._heartbeat.start()
+
+    def _beat(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                if self._owner() != self.worker_id:
+                    raise FileNotFoundError(self.lease_path)
+                os.utime(self.lease_path)
+            except OSError:
+                # Our lease expired and another worker took the file over
+                self.lost = True
+                return
+
+    def _owner(self):
+        with open(self.lease_path, "r", encoding="utf-8") as f:
+            return f.readline().strip()
+
+    def held(self):
+        """
+        Whether this worker still owns the lease, read from the lease file itself.
+
+        The heartbeat only notices a takeover every ``heartbeat_seconds``, so check
+        this right before any step that must happen exactly once per file.
+        """
+        if not self.lost:
+            try:
+                if self._owner() == self.worker_id:
+                    return True
+            except OSError:
+                pass
+            self.lost = True
+        return False
+
+    def release(self):
+        """Stop the heartbeat and delete the lease file if we still own it."""
+        self._stop.set()
+        self._heartbeat.join()
+        try:
+            if self._owner() == self.worker_id:
+                os.remove(self.lease_path)
+        except OSError:
+            pass
+
+
+class LeaseQueue:
+    """
+    Hand out audio files from a shared directory to exactly one worker each.
+
+    Parameters:
+    -----------
+    directory : str
+        The shared downloads directory
+    worker_id : str
+        Identifier written into lease files; defaults to hostname:pid:random
+    lease_seconds : float
+        A lease not refreshed for this long is considered abandoned
+    heartbeat_seconds : float
+        How often a live worker refreshes its leases
+    """
+
+    def __init__(self, directory, worker_id=None, lease_seconds=120, heartbeat_seconds=30):
+        self.directory = directory
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.lease_directory = os.path.join(directory, LEASE_DIRECTORY)
+        os.makedirs(self.lease_directory, exist_ok=True)
+
+    def _lease_path(self, audio_path):
+        return os.path.join(self.lease_directory, os.path.basename(audio_path) + ".lease")
+
+    def _create(self, lease_path):
+        """Atomically create the lease file; False if someone else holds it."""
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(f"{self.worker_id}\n{time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        return True
+
+    def _server_time(self):
+        """The file server's current time: the mtime of a probe file touched just now."""
+        probe_path = os.path.join(self.lease_directory, f".clock.{self.worker_id.replace(':', '_')}")
+        with open(probe_path, "w", encoding="utf-8"):
+            pass
+        os.utime(probe_path)
+        try:
+            return os.path.getmtime(probe_path)
+        finally:
+            os.remove(probe_path)
+
+    def _is_expired(self, lease_path):
+        try:
+            touched = os.path.getmtime(lease_path)
+        except FileNotFoundError:
+            return False
+        # Both mtimes come from the server, so local clock skew doesn't matter
+        return self._server_time() - touched > self.lease_seconds
+
+    def _break_expired(self, lease_path):
+        """
+        Remove an abandoned lease. Renaming is atomic, so only one worker wins;
+        if the lease turned out to be fresh after all, it is put back.
+        """
+        stale_path = f"{lease_path}.{self.worker_id.replace(':', '_')}.stale"
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return
+        if not self._is_expired(stale_path):
+            try:
+                os.link(stale_path, lease_path)
+            except OSError:
+                pass
+            os.remove(stale_path)
+            return
+        os.remove(stale_path)
+        print(f"Broke expired lease {os.path.basename(lease_path)}")
+
+    def live_leases(self):
+        """Map the name of every audio file under a live lease to the worker holding it."""
+        owners = {}
+        now = self._server_time()
+        for name in os.listdir(self.lease_directory):
+            if not name.endswith(".lease"):
+                continue
+            lease_path = os.path.join(self.lease_directory, name)
+            try:
+                if now - os.path.getmtime(lease_path) > self.lease_seconds:
+                    continue
+                with open(lease_path, "r", encoding="utf-8") as f:
+                    owners[name[:-len(".lease")]] = f.readline().strip()
+            except OSError:
+                # Released while we looked
+                continue
+        return owners
+
+    def claim(self, audio_path):
+        """Try to lease ``audio_path``; return a Lease or None."""
+        lease_path = self._lease_path(audio_path)
+
+        if self._is_expired(lease_path):
+            self._break_expired(lease_path)
+
+        if not self._create(lease_path):
+            return None
+
+        # Another worker may have finished and moved the file since we listed it
+        if not os.path.exists(audio_path):
+            os.remove(lease_path)
+            return None
+
+        return Lease(audio_path, lease_path, self.worker_id, self.heartbeat_seconds)
+
+    def jobs(self, list_files):
+        """
+        Yield a Lease for each file this worker wins, rescanning with
+        ``list_files()`` after every job so new and re-queued files are picked up.
+        The caller must release each lease. A file is handed out at most once per
+        call, so one that fails here is left for another worker or the next run.
+        """
+        attempted = set()
+        while True:
+            for audio_path in sorted(list_files()):
+                if audio_path in attempted:
+                    continue
+                lease = self.claim(audio_path)
+                if lease is not None:
+                    break
+            else:
+                return
+            attempted.add(audio_path)
+            yield lease
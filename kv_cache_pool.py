@@ -0,0 +1,192 @@
+"""
+KV Cache Pool - decoder key/value caches that outlive a window
+
+Whisper's PyTorchInference rebuilds the text decoder's caches for every
+30-second window: the self-attention cache grows by concatenation, so every
+decoding step allocates a new, larger tensor per layer; cross-attention
+keys/values are computed and stored once per beam (or best_of sample) although
+all of them see the same audio; and beam search reorders the cache with a fresh
+copy after every step. On CPU that is a steady stream of large short-lived
+allocations over a long run.
+
+KVCachePool allocates the caches once per model, sized for the configured
+beam_size/best_of and the model's context lengths, and PooledInference fills
+them in place for every window of every file:
+
+- self-attention keys/values are written into (n_group, n_text_ctx, n_state)
+  buffers and the decoder is handed views of the filled part
+- cross-attention keys/values are computed once per window into a single-row
+  buffer that every beam reads through a broadcast view
+- beam reordering goes through one shared scratch buffer
+
+Windows that don't fit the pool (batched audio, or more beams than it was
+sized for) and compiled decoders use Whisper's regular caching unchanged.
+"""
+
+import torch
+
+from whisper.decoding import PyTorchInference
+from whisper.model import TextDecoder
+
+from decoding_hooks import install_decoding_hooks
+
+
+class KVCachePool:
+    """
+    Key/value buffers for one model's text decoder, shared by all its windows.
+
+    Parameters:
+    -----------
+    model : whisper.model.Whisper
+        The model whose decoder the buffers are for
+    n_group : int
+        Most sequences decoded together per window, i.e. max(beam_size, best_of)
+    """
+
+    def __init__(self, model, n_group):
+        self.model = model
+        self.n_group = n_group
+        self.dtype = None
+        self.device = None
+        self.self_kv = {}
+        self.cross_kv = {}
+        self.scratch = None
+        # Number of times the buffers were (re)allocated, e.g. on a dtype change
+        self.allocations = 0
+
+    @property
+    def nbytes(self):
+        buffers = list(self.self_kv.values()) + list(self.cross_kv.values())
+        if self.scratch is not None:
+            buffers.append(self.scratch)
+        return sum(buffer.numel() * buffer.element_size() for buffer in buffers)
+
+    def prepare(self, audio_features):
+        """Allocate the buffers for the dtype/device of ``audio_features`` unless they already are."""
+        if (audio_features.dtype, audio_features.device) == (self.dtype, self.device):
+            return
+
+        dims = self.model.dims
+        blocks = self.model.decoder.blocks
+        options = dict(dtype=audio_features.dtype, device=audio_features.device)
+        self_shape = (self.n_group, dims.n_text_ctx, dims.n_text_state)
+
+        # Drop the old buffers before allocating new ones
+        self.self_kv, self.cross_kv, self.scratch = {}, {}, None
+        self.self_kv = {
+            module: torch.empty(self_shape, **options)
+            for block in blocks for module in (block.attn.key, block.attn.value)
+        }
+        self.cross_kv = {
+            module: torch.empty((1, audio_features.shape[1], dims.n_text_state), **options)
+            for block in blocks if block.cross_attn is not None
+            for module in (block.cross_attn.key, block.cross_attn.value)
+        }
+        self.scratch = torch.empty(self_shape, **options).view(-1)
+        self.dtype, self.device = audio_features.dtype, audio_features.device
+        self.allocations += 1
+
+
+class PooledInference(PyTorchInference):
+    """PyTorchInference that keeps its key/value cache in a KVCachePool."""
+
+    def __init__(self, model, initial_token_length, pool, n_group):
+        super().__init__(model, initial_token_length)
+        self.pool = pool
+        self.n_group = n_group
+        # Decided on the first call, once the batch size is known
+        self.pooled = None
+
+    def logits(self, tokens, audio_features):
+        if self.pooled is None:
+            # One recording per window, so all rows of audio_features are the same audio
+            self.pooled = audio_features.shape[0] == self.n_group <= self.pool.n_group
+            if self.pooled:
+                self._start(audio_features)
+
+        if not self.pooled:
+            return super().logits(tokens, audio_features)
+
+        if tokens.shape[-1] > self.initial_token_length:
+            # only need to use the last token except in the first forward pass
+            tokens = tokens[:, -1:]
+
+        return self.model.decoder(tokens, audio_features, kv_cache=self.kv_cache)
+
+    def _start(self, audio_features):
+        self.pool.prepare(audio_features)
+        n_batch = audio_features.shape[0]
+
+        # Self-attention entries go first: TextDecoder reads its position offset
+        # from the length of the first cache entry
+        self.kv_cache = {module: buffer[:n_batch, :0] for module, buffer in self.pool.self_kv.items()}
+
+        # Cross-attention keys/values from a single row, shared by every beam
+        # (the same addmm/mm whisper.model.Linear runs)
+        xa = audio_features[0]
+        for module, buffer in self.pool.cross_kv.items():
+            weight = module.weight.to(xa.dtype)
+            if module.bias is not None:
+                torch.addmm(module.bias.to(xa.dtype), xa, weight.t(), out=buffer[0])
+            else:
+                torch.mm(xa, weight.t(), out=buffer[0])
+            self.kv_cache[module] = buffer.expand(n_batch, -1, -1)
+
+        self.hooks = [module.register_forward_hook(self._append) for module in self.pool.self_kv]
+
+    def _append(self, module, _, output):
+        """Forward hook: write the new keys/values after the cached ones and return the filled view."""
+        start = self.kv_cache[module].shape[1]
+        end = start + output.shape[1]
+        buffer = self.pool.self_kv[module]
+        buffer[:output.shape[0], start:end].copy_(output)
+        self.kv_cache[module] = buffer[:output.shape[0], :end]
+        return self.kv_cache[module]
+
+    def cleanup_caching(self):
+        super().cleanup_caching()
+        self.pooled = None
+
+    def rearrange_kv_cache(self, source_indices):
+        if not self.pooled:
+            return super().rearrange_kv_cache(source_indices)
+
+        if source_indices != list(range(len(source_indices))):
+            index = torch.tensor(source_indices, device=self.pool.device)
+            for module in self.kv_modules:
+                cached = self.kv_cache[module]
+                scratch = self.pool.scratch[:cached.numel()].view(cached.shape)
+                torch.index_select(cached, 0, index, out=scratch)
+                cached.copy_(scratch)
+
+
+def install_kv_pool(model, n_group):
+    """
+    Make every ``model.decode`` call keep its decoder cache in a pool reused across windows and files.
+
+    Parameters:
+    -----------
+    model : whisper.model.Whisper
+        The model used by whisper.transcribe
+    n_group : int
+        Size the pool for this many sequences per window, i.e. max(beam_size, best_of)
+
+    Returns:
+    --------
+    pool : KVCachePool or None
+        The pool, or None if the decoder was replaced by a compiled backend
+    """
+    if not isinstance(model.decoder, TextDecoder):
+        return None
+
+    pool = KVCachePool(model, n_group)
+    setup = install_decoding_hooks(model)
+
+    def use_pool(task):
+        task.inference = PooledInference(model, len(task.initial_tokens), pool, task.n_group)
+        # The beam search decoder reorders the cache through its own reference
+        if hasattr(task.decoder, "inference"):
+            task.decoder.inference = task.inference
+
+    setup.task_hooks.append(use_pool)
+    return pool
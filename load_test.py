@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Load test for the whole download -> transcribe pipeline, without a Google account
+
+For each load level a fake Drive server is seeded with N synthetic recordings
+and download-from-gdrive.py is pointed at it through GDRIVE_API_ENDPOINT. The
+scheduler's run_script() then runs the downloader and local_whisper.py (with a
+small model swapped in) in cycles until the fake Drive and the downloads
+directory are empty, inside a scratch working directory:
+
+    python load_test.py --model tiny.pt --files 5 20 50
+
+Reported per level: throughput, end-to-end latency percentiles (from the
+pipeline latency log), recordings that never got transcribed, scripts that
+exited with an error and bytes downloaded more than once. The exit code is 1
+on any failure, or when throughput at a higher load falls more than
+--max-slowdown below the lowest load's.
+
+update_config_date.py is not run: it rewrites the real config.json.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from ffmpeg_utils import setup_ffmpeg_path
+from pipeline_timing import LATENCY_LOG, LatencyTracker, backlog_stats
+
+ffmpeg_path = setup_ffmpeg_path()
+
+FOLDER_NAME = 'a-daily-log'  # Must match download-from-gdrive.py
+FOLDER_ID = 'fake-folder'
+# Drive's default page size for files.list
+DEFAULT_PAGE_SIZE = 100
+
+
+class FakeDrive:
+    """
+    An in-memory Drive folder served over HTTP, implementing the part of the
+    v3 API the downloader uses: files.list (with fields and paging), files.get
+    with alt=media (with Range requests) and files.delete.
+
+    Parameters:
+    -----------
+    fault_rate : float
+        Fraction of media downloads and deletes answered with HTTP 500
+    seed : int
+        Seed for choosing which requests fail
+    """
+
+    def __init__(self, fault_rate=0.0, seed=0):
+        self.files = {}
+        self.fault_rate = fault_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = dict(list_requests=0, media_requests=0, bytes_served=0, deletes=0, faults=0)
+        # Per file id: size, and bytes served for it across all requests
+        self.sizes = {}
+        self.served = {}
+
+        handler = type('FakeDriveHandler', (_DriveRequestHandler,), {'drive': self})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/drive/v3/"
+
+    @property
+    def redundant_bytes(self):
+        """Bytes served beyond one full copy of each file, i.e. re-downloads."""
+        return sum(max(0, served - self.sizes[file_id]) for file_id, served in self.served.items())
+
+    def add_file(self, name, data, mime_type='audio/mp4'):
+        file_id = f"file-{len(self.files):05d}"
+        self.files[file_id] = ({
+            'id': file_id,
+            'name': name,
+            'mimeType': mime_type,
+            'md5Checksum': hashlib.md5(data).hexdigest(),
+            'size': str(len(data)),
+        }, data)
+        self.sizes[file_id] = len(data)
+
+    def start(self):
+        """Stamp every file as uploaded now and start serving."""
+        created = datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+        for metadata, _ in self.files.values():
+            metadata['createdTime'] = created
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fault(self):
+        with self.lock:
+            if self.random.random() < self.fault_rate:
+                self.counters['faults'] += 1
+                return True
+        return False
+
+
+class _DriveRequestHandler(BaseHTTPRequestHandler):
+    drive = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status, message):
+        self._send_json(status, {'error': {'code': status, 'message': message}})
+
+    def _file_id(self, path):
+        match = re.fullmatch(r'/drive/v3/files/([^/]+)', path)
+        return match.group(1) if match else None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == '/drive/v3/files':
+            self._list(query)
+            return
+
+        file_id = self._file_id(url.path)
+        with self.drive.lock:
+            entry = self.drive.files.get(file_id)
+        if entry is None:
+            self._send_error(404, f"File not found: {file_id}")
+        elif query.get('alt') == 'media':
+            self._media(*entry)
+        else:
+            self._send_json(200, entry[0])
+
+    def do_DELETE(self):
+        file_id = self._file_id(urlsplit(self.path).path)
+        if self.drive.fault():
+            self._send_error(500, "Injected delete failure")
+            return
+        with self.drive.lock:
+            removed = self.drive.files.pop(file_id, None)
+            if removed is not None:
+                self.drive.counters['deletes'] += 1
+        if removed is None:
+            self._send_error(404, f"File not found: {file_id}")
+            return
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _list(self, query):
+        with self.drive.lock:
+            self.drive.counters['list_requests'] += 1
+            if "mimeType = 'application/vnd.google-apps.folder'" in query.get('q', ''):
+                items = [{'id': FOLDER_ID, 'name': FOLDER_NAME, 'mimeType': 'application/vnd.google-apps.folder'}]
+            else:
+                items = [dict(metadata) for metadata, _ in self.drive.files.values()]
+
+        # Page like Drive does, so a downloader that ignores nextPageToken shows up under load
+        start = int(query.get('pageToken', 0))
+        page_size = int(query.get('pageSize', DEFAULT_PAGE_SIZE))
+        body = {'files': items[start:start + page_size]}
+        if start + page_size < len(items):
+            body['nextPageToken'] = str(start + page_size)
+
+        # Only return the requested fields, e.g. fields='files(id, name, md5Checksum)'
+        match = re.search(r'files\(([^)]*)\)', query.get('fields', ''))
+        if match:
+            wanted = {field.strip() for field in match.group(1).split(',')}
+            body['files'] = [{k: v for k, v in item.items() if k in wanted} for item in body['files']]
+        self._send_json(200, body)
+
+    def _media(self, metadata, data):
+        if self.drive.fault():
+            self._send_error(500, "Injected download failure")
+            return
+
+        start, end = 0, len(data) - 1
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(end, int(match.group(2))) if match.group(2) else end
+        chunk = data[start:end + 1]
+
+        self.send_response(206 if match else 200)
+        self.send_header('Content-Type', metadata['mimeType'])
+        self.send_header('Content-Length', str(len(chunk)))
+        if match:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{len(data)}")
+        self.end_headers()
+        self.wfile.write(chunk)
+
+        with self.drive.lock:
+            self.drive.counters['media_requests'] += 1
+            self.drive.counters['bytes_served'] += len(chunk)
+            self.drive.served[metadata['id']] = self.drive.served.get(metadata['id'], 0) + len(chunk)
+
+
+def make_recording(path, seconds, frequency):
+    """Write a compressed tone with FFmpeg; different frequencies give different checksums."""
+    subprocess.run(
+        [
+            ffmpeg_path, "-nostdin", "-loglevel", "error", "-y",
+            "-f", "lavfi", "-i", f"sine=frequency={frequency}:sample_rate=16000:duration={seconds:.2f}",
+            "-ac", "1", "-c:a", "aac", "-b:a", "32k", path,
+        ],
+        check=True,
+    )
+
+
+def resolve_model_folder(config_path, model_folder):
+    """The model folder as an absolute path; a relative one is relative to the config's directory."""
+    return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(config_path)), model_folder))
+
+
+def write_config(args, workdir):
+    """Write the working directory's config.json: the real settings with a small model and local paths."""
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    config.update(
+        downloads_directory="./downloads",
+        processed_directory="./processed_audio",
+        output_file="load_test.txt",
+        verbose=False,
+        device=args.device,
+    )
+    # A relative model folder is relative to the real config, not to the scratch directory we run in
+    config["model"] = dict(
+        config["model"], folder=resolve_model_folder(args.config, config["model"]["folder"]),
+        name=args.model, draft_name=None
+    )
+    if args.device == "cpu":
+        config["advanced"]["fp16"] = False
+    # Routing rules name other checkpoints; every file goes to the small model here
+    config.setdefault("routing", {})["enabled"] = False
+    if args.workers:
+        config.setdefault("queue", {}).update(enabled=True, workers=args.workers)
+
+    with open(os.path.join(workdir, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+
+
+def run_level(args, scheduler, root, n_files):
+    """Run the pipeline against a fake Drive holding n_files recordings and return its measurements."""
+    workdir = os.path.join(root, f"load_{n_files}")
+    seed_dir = os.path.join(workdir, "seed")
+    os.makedirs(seed_dir)
+    write_config(args, workdir)
+
+    rng = random.Random(n_files)
+    drive = FakeDrive(args.fault_rate, seed=n_files)
+    audio_seconds = 0.0
+    for i in range(n_files):
+        seconds = rng.uniform(args.min_seconds, args.max_seconds)
+        path = os.path.join(seed_dir, f"recording_{i:04d}.m4a")
+        make_recording(path, seconds, frequency=200 + i)
+        with open(path, 'rb') as f:
+            drive.add_file(os.path.basename(path), f.read())
+        audio_seconds += seconds
+
+    os.environ['GDRIVE_API_ENDPOINT'] = drive.endpoint
+    os.chdir(workdir)
+    tracker = LatencyTracker(LATENCY_LOG)
+    script_failures = 0
+    cycles = 0
+
+    drive.start()
+    start = time.monotonic()
+    try:
+        while cycles < args.max_cycles and (drive.files or backlog_stats('./downloads')['files']):
+            cycles += 1
+            if scheduler.run_script(scheduler.DOWNLOAD_SCRIPT_PATH, "Download script") != 0:
+                script_failures += 1
+            if backlog_stats('./downloads')['files']:
+                if scheduler.run_script(scheduler.WHISPER_SCRIPT_PATH, "Transcription script") != 0:
+                    script_failures += 1
+    finally:
+        elapsed = time.monotonic() - start
+        drive.stop()
+        os.chdir(root)
+
+    tracker.update()
+    end_to_end = tracker.summary()["latency_seconds"]["end_to_end"]
+    transcribed = tracker.files_seen
+    return dict(
+        files=n_files,
+        cycles=cycles,
+        seconds=round(elapsed, 1),
+        transcribed=transcribed,
+        files_per_minute=round(transcribed / elapsed * 60, 2) if elapsed else 0.0,
+        audio_realtime_factor=round(audio_seconds * transcribed / n_files / elapsed, 2) if elapsed else 0.0,
+        latency_p50=end_to_end["p50"],
+        latency_p95=end_to_end["p95"],
+        latency_p99=end_to_end["p99"],
+        missing=n_files - transcribed,
+        left_on_drive=len(drive.files),
+        script_failures=script_failures,
+        injected_faults=drive.counters['faults'],
+        redundant_bytes=drive.redundant_bytes,
+    )
+
+
+def format_seconds(value):
+    return f"{value:.1f}s" if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test the download -> transcribe pipeline against a fake Google Drive",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--config", type=str, default="config.json", help="configuration to base the runs on")
+    parser.add_argument("--model", default="tiny.pt", help="small model file in the model folder")
+    parser.add_argument("--device", default="cpu", help="device to transcribe on")
+    parser.add_argument("--files", type=int, nargs="+", default=[5, 20, 50], help="recordings per load level")
+    parser.add_argument("--min-seconds", type=float, default=5, help="shortest synthetic recording")
+    parser.add_argument("--max-seconds", type=float, default=30, help="longest synthetic recording")
+    parser.add_argument("--max-cycles", type=int, default=5, help="pipeline cycles allowed per level")
+    parser.add_argument("--workers", type=int, default=0, help="enable the lease queue with this many workers")
+    parser.add_argument("--fault-rate", type=float, default=0.0,
+                        help="fraction of Drive downloads and deletes that fail with HTTP 500")
+    parser.add_argument("--max-slowdown", type=float, default=0.5,
+                        help="allowed drop in files per minute relative to the lowest load")
+    parser.add_argument("--workdir", default=None, help="keep the runs in this directory instead of a temporary one")
+    parser.add_argument("--report", default=None, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    args.config = os.path.abspath(args.config)
+    # Without the checkpoint every transcription would fail and the numbers would mean nothing
+    with open(args.config, 'r', encoding='utf-8') as f:
+        model_path = os.path.join(resolve_model_folder(args.config, json.load(f)["model"]["folder"]), args.model)
+    if not os.path.isfile(model_path):
+        print(f"Model {model_path} not found; pass a checkpoint from the model folder with --model")
+        sys.exit(1)
+    report_path = os.path.abspath(args.report) if args.report else None
+    root = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="load_test_")
+    os.makedirs(root, exist_ok=True)
+    original_dir = os.getcwd()
+
+    # Imported here so the scheduler's log file lands in the scratch directory
+    os.chdir(root)
+    import scheduler
+
+    results = []
+    try:
+        for n_files in sorted(args.files):
+            print(f"\nLoad level: {n_files} recordings")
+            results.append(run_level(args, scheduler, root, n_files))
+    finally:
+        os.chdir(original_dir)
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    print(f"\n{'files':>6} {'cycles':>6} {'time':>8} {'files/min':>9} {'x rt':>6} "
+          f"{'p50':>8} {'p95':>8} {'p99':>8} {'missing':>7} {'failed':>6} {'redundant':>10}")
+    for r in results:
+        print(f"{r['files']:>6} {r['cycles']:>6} {format_seconds(r['seconds']):>8} {r['files_per_minute']:>9.2f} "
+              f"{r['audio_realtime_factor']:>6.2f} {format_seconds(r['latency_p50']):>8} "
+              f"{format_seconds(r['latency_p95']):>8} {format_seconds(r['latency_p99']):>8} "
+              f"{r['missing']:>7} {r['script_failures']:>6} {r['redundant_bytes'] / 1e6:>8.1f}MB")
+
+    failed = any(r['missing'] or r['script_failures'] or r['redundant_bytes'] for r in results)
+    baseline = results[0]['files_per_minute']
+    for r in results[1:]:
+        if baseline and r['files_per_minute'] < baseline * (1 - args.max_slowdown):
+            print(f"Scaling regression: {r['files_per_minute']:.2f} files/min at {r['files']} recordings "
+                  f"vs {baseline:.2f} at {results[0]['files']}")
+            failed = True
+
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {report_path}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
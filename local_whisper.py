@@ -8,20 +8,26 @@ This script is a modified version of Whisper's CLI that:
 3. Uses configuration from config.json for paths and settings
 4. Automatically transcribes all files in the downloads directory
 5. Appends all transcriptions to a single output file
+6. Can stream very long recordings through a fixed-size buffer instead of loading them whole
 """
 
 import sys
 import io
 import argparse
 import os
+import subprocess
 import sys
 import traceback
 import warnings
 import json
+import time
 from typing import List, Optional, Tuple, Union
 from datetime import datetime
 # Import the FFmpeg path setup function
-from ffmpeg_utils import setup_ffmpeg_path
+from ffmpeg_utils import setup_ffmpeg_path, probe_duration
+from transcriber_lock import transcribing
+# Re-exported: autotune.py and benchmark.py load the configuration through this module
+from config_loader import host_config_path, load_config, merge_config
 
 # Configure FFmpeg path early
 ffmpeg_path = setup_ffmpeg_path()
@@ -40,53 +46,23 @@ try:
     )
     # You might need to set the FFmpeg path for whisper
     whisper.audio.FFMPEG_PATH = ffmpeg_path
+    from speculative_decoding import install_speculative_decoding
+    from streaming_audio import transcribe_streaming
+    from inference_backends import apply_backends, calibrate_backends, record_calibration, resolve_backends
+    from job_queue import LeaseQueue
+    from pipeline_timing import record_transcription
+    from repetition_guard import RepetitionStats, install_repetition_guard
+    from model_registry import ModelRegistry, ModelRouter, detect_language
+    from kv_cache_pool import install_kv_pool
+    from cycle_deadline import (
+        DEGRADED_LOG, DeadlinePlanner, cycle_deadline, level_options, load_degraded, log_degraded,
+        queued_audio_seconds, save_degraded
+    )
 except ImportError:
     print("Error: Whisper package not found. Please install it using pip.")
     sys.exit(1)
 
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-
-def load_config(config_path="config.json"):
-    """Load configuration from a JSON file."""
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-        print(f"Loaded configuration from {config_path}")
-        return config
-    except FileNotFoundError:
-        print(f"Configuration file {config_path} not found. Using default settings.")
-        # Return a default configuration
-        return {
-            "downloads_directory": "./downloads",
-            "output_file": "250321_daily.txt",
-            "processed_directory": "./processed_audio",
-            "model": {
-                "folder": "./model",
-                "name": "my_model.pt"
-            },
-            "transcription": {
-                "task": "transcribe",
-                "language": None,
-                "temperature": 0,
-                "word_timestamps": False
-            },
-            "advanced": {
-                "best_of": 5,
-                "beam_size": 5,
-                "patience": None,
-                "length_penalty": None,
-                "suppress_tokens": "-1",
-                "initial_prompt": None,
-                "condition_on_previous_text": True,
-                "fp16": True,
-                "threads": 0
-            },
-            "verbose": True,
-            "device": "cuda" if torch.cuda.is_available() else "cpu"
-        }
-    except json.JSONDecodeError:
-        print(f"Error parsing {config_path}. Using default settings.")
-        sys.exit(1)
+sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', line_buffering=True)
 
 def load_local_model(model_folder, model_name, device):
     """
@@ -134,10 +110,296 @@ def load_local_model(model_folder, model_name, device):
     
     return model.to(device)
 
+def prepare_model(model, model_name, model_folder, device, config, repetition_stats=None, verbose=True):
+    """
+    Apply the configured inference backends and repetition guard to a loaded model.
+    
+    Parameters:
+    -----------
+    model : whisper.model.Whisper
+        The loaded Whisper model
+    model_name : str
+        Name of the model file, used to locate cached backend artifacts
+    model_folder : str
+        Path to the folder containing the model
+    device : str
+        The device the model was loaded onto
+    config : dict
+        The loaded configuration
+    repetition_stats : RepetitionStats
+        Shared counters for the repetition guard, if it is enabled
+    verbose : bool
+        Whether to print progress messages
+        
+    Returns:
+    --------
+    model : whisper.model.Whisper
+        The same model, ready for transcription
+    """
+    # Run the encoder/decoder through the configured (or calibrated) backends
+    encoder_backend, decoder_backend = resolve_backends(config)
+    if (encoder_backend, decoder_backend) != ("eager", "eager"):
+        try:
+            apply_backends(model, encoder_backend, decoder_backend, model_folder, model_name, device)
+            if verbose:
+                print(f"Using inference backends for {model_name}: encoder={encoder_backend}, decoder={decoder_backend}")
+        except Exception as e:
+            print(f"Could not set up backends for {model_name} ({str(e)}); falling back to eager PyTorch")
+    
+    # Stop windows that fall into repetition loops as soon as the loop is detected
+    guard_config = config.get("repetition_guard", {})
+    if guard_config.get("enabled"):
+        install_repetition_guard(
+            model,
+            max_ngram=guard_config.get("max_ngram", 8),
+            min_repeats=guard_config.get("min_repeats", 4),
+            min_span_tokens=guard_config.get("min_span_tokens", 16),
+            action=guard_config.get("action", "fallback"),
+            stats=repetition_stats,
+            max_temperature=max(build_decode_options(config, None)["temperature"]),
+        )
+    
+    # Keep the decoder's key/value cache in buffers reused across windows and files
+    if config.get("kv_pool", {}).get("enabled"):
+        advanced_config = config["advanced"]
+        n_group = max(advanced_config.get("beam_size") or 1, advanced_config.get("best_of") or 1)
+        if install_kv_pool(model, n_group) is None:
+            print(f"KV cache pool not used for {model_name}: its decoder runs through a compiled backend")
+    
+    return model
+
+def build_decode_options(config, language):
+    """
+    Build the whisper.transcribe keyword arguments from the configuration
+    
+    Parameters:
+    -----------
+    config : dict
+        The loaded configuration
+    language : str
+        Language to transcribe in, or None to detect it per file
+        
+    Returns:
+    --------
+    decode_options : dict
+        Options passed to whisper.transcribe for every file
+    """
+    transcription_config = config["transcription"]
+    advanced_config = config["advanced"]
+    
+    # Process temperature
+    temperature = transcription_config["temperature"]
+    if temperature > 0:
+        # Use a tuple of temperatures increasing up to 1.0 for fallback
+        temperature = tuple(np.arange(temperature, 1.0 + 1e-6, 0.2))
+    else:
+        temperature = [temperature]
+    
+    return dict(
+        temperature=temperature,
+        task=transcription_config["task"],
+        language=language,
+        word_timestamps=transcription_config["word_timestamps"],
+        best_of=advanced_config["best_of"],
+        beam_size=advanced_config["beam_size"],
+        patience=advanced_config["patience"],
+        length_penalty=advanced_config["length_penalty"],
+        suppress_tokens=advanced_config["suppress_tokens"],
+        initial_prompt=advanced_config["initial_prompt"],
+        condition_on_previous_text=advanced_config["condition_on_previous_text"],
+        fp16=advanced_config["fp16"],
+    )
+
+def select_model_for_file(audio_path, model, model_name, decode_options, registry=None, router=None,
+                          routing_config=None, planner=None, backlog=None, remaining_audio=None, verbose=True):
+    """
+    Pick the model and decoding options for one file: the routing rule that
+    matches it, then the deadline level the remaining time allows
+    
+    Parameters:
+    -----------
+    audio_path : str
+        The file about to be transcribed
+    model : whisper.model.Whisper
+        The configured model, used unless a rule or level picks another
+    model_name : str
+        Name of the configured model file
+    decode_options : dict
+        The configured decoding options
+    registry : ModelRegistry
+        Resident models, if routing or deadline mode is enabled
+    router : ModelRouter
+        The routing rules, if routing is enabled
+    routing_config : dict
+        The routing section of the configuration
+    planner : DeadlinePlanner
+        The deadline planner, if deadline mode is enabled
+    backlog : int
+        Files still waiting, including this one
+    remaining_audio : float
+        Seconds of audio this worker still has to transcribe, including this file
+    verbose : bool
+        Whether to print progress messages
+        
+    Returns:
+    --------
+    selection : dict
+        The "model", "model_name" and "decode_options" to transcribe with, the
+        deadline "level" (0 for full quality), and the routing "reason" and
+        probed "duration" for the routing summary
+    """
+    selection = dict(
+        model=model, model_name=model_name, decode_options=decode_options, level=0, reason=None, duration=None
+    )
+    
+    # Pick the model for this file from the routing rules
+    if router is not None:
+        try:
+            duration = probe_duration(audio_path, ffmpeg_path)
+        except Exception:
+            duration = None
+        language = decode_options["language"]
+        if router.needs_language and language is None:
+            language_model_name = routing_config.get("language_model") or model_name
+            try:
+                language_model = registry.get(language_model_name)
+            except Exception as e:
+                print(f"Could not load {language_model_name} ({str(e)}); detecting the language with {model_name}")
+                language_model = model
+            language = detect_language(language_model, audio_path, ffmpeg_path)
+        
+        routed_name, reason = router.route(duration, language, backlog)
+        try:
+            routed_model = registry.get(routed_name)
+        except Exception as e:
+            print(f"Could not load {routed_name} ({str(e)}); using {model_name} instead")
+            routed_name, routed_model, reason = model_name, model, f"{reason}, {routed_name} unavailable"
+        # Reuse the detected language, and force English on English-only checkpoints
+        routed_language = "en" if os.path.splitext(routed_name)[0].endswith(".en") else language
+        selection.update(
+            model=routed_model, model_name=routed_name, reason=reason, duration=duration,
+            decode_options=dict(decode_options, language=routed_language),
+        )
+        if verbose:
+            print(f"Routing {os.path.basename(audio_path)} to {routed_name} via {reason}")
+    
+    # Step down to cheaper settings if full quality is projected to miss the deadline
+    if planner is not None:
+        level = planner.choose(remaining_audio)
+        # A level whose model can't be loaded is dropped for the rest of the run:
+        # the box is behind, so the file must still be transcribed somehow
+        level_model = None
+        while level and planner.levels[level].get("model"):
+            settings = planner.levels[level]
+            try:
+                level_model = registry.get(settings["model"])
+                break
+            except Exception as e:
+                print(f"Deadline mode: cannot use '{settings.get('name', level)}' settings ({str(e)}); "
+                      f"falling back to the next available level")
+                planner.remove_level(level)
+                level = planner.choose(remaining_audio)
+        
+        if level:
+            settings = planner.levels[level]
+            if settings.get("model"):
+                selection.update(model=level_model, model_name=settings["model"])
+            level_decode_options = dict(selection["decode_options"], **level_options(settings))
+            if os.path.splitext(selection["model_name"])[0].endswith(".en"):
+                level_decode_options["language"] = "en"
+            selection.update(decode_options=level_decode_options, level=level)
+            print(f"Deadline mode: {remaining_audio / 60:.1f} min of audio queued with "
+                  f"{planner.time_left() / 60:.1f} min left, using '{settings.get('name', level)}' settings")
+    
+    return selection
+
+def transcribe_audio(model, audio_path, streaming_config, verbose, decode_options):
+    """Transcribe one file, streaming it through a bounded buffer if streaming is enabled."""
+    if streaming_config.get("enabled"):
+        return transcribe_streaming(
+            model,
+            audio_path,
+            chunk_seconds=streaming_config.get("chunk_seconds", 60),
+            ffmpeg_path=ffmpeg_path,
+            verbose=verbose,
+            **decode_options,
+        )
+    return whisper.transcribe(
+        model=model,
+        audio=audio_path,
+        verbose=verbose,
+        **decode_options,
+    )
+
+def reprocess_degraded(model, decode_options, streaming_config, output_file, planner, verbose=True):
+    """
+    Re-transcribe files logged by deadline mode at full quality, oldest first,
+    while each next file is projected to finish before the planner's deadline.
+    
+    Parameters:
+    -----------
+    model : whisper.model.Whisper
+        The configured (full-quality) model
+    decode_options : dict
+        The configured decoding options
+    streaming_config : dict
+        The streaming section of the configuration
+    output_file : str
+        Output file the full-quality transcriptions are appended to
+    planner : DeadlinePlanner
+        Deadline and measured real-time factor
+    verbose : bool
+        Whether to print progress messages
+    """
+    entries = load_degraded()
+    if not entries:
+        print("No degraded files to reprocess")
+        return
+    
+    initialize_or_append_to_output_file(output_file, verbose)
+    durations = {}
+    remaining = list(entries)
+    reprocessed = 0
+    for entry in entries:
+        audio_path = entry["path"]
+        if not os.path.exists(audio_path):
+            # The archive transcoder may have replaced it with an Opus copy
+            audio_path = os.path.splitext(audio_path)[0] + ".opus"
+        if not os.path.exists(audio_path):
+            print(f"Cannot reprocess {entry['file']}: {entry['path']} no longer exists")
+            remaining.remove(entry)
+            continue
+        
+        if not planner.fits(queued_audio_seconds([audio_path], durations, ffmpeg_path)):
+            print(f"Stopping reprocessing: {entry['file']} is not projected to finish before the deadline")
+            break
+        
+        try:
+            if verbose:
+                print(f"\nReprocessing {entry['file']} (degraded to '{entry['level']}' on {entry['transcribed_at']})")
+            started = time.time()
+            result = transcribe_audio(model, audio_path, streaming_config, verbose, decode_options)
+            planner.record(0, durations[audio_path], time.time() - started)
+            append_transcription_to_file(
+                result["text"], audio_path, output_file,
+                note=f"Full-quality re-transcription, replaces the degraded one in {entry['output_file']}"
+            )
+            remaining.remove(entry)
+            reprocessed += 1
+        except Exception as e:
+            traceback.print_exc()
+            print(f"Skipping {audio_path} due to {type(e).__name__}: {str(e)}")
+        
+        # Keep the log current so an interrupted run doesn't redo finished files
+        save_degraded(remaining)
+    
+    save_degraded(remaining)
+    print(f"\nReprocessed {reprocessed} degraded files, {len(remaining)} left")
+
 def get_audio_files_from_directory(directory_path):
     """Get all audio files from the specified directory."""
     # Common audio file extensions
-    audio_extensions = ['.mp3', '.wav', '.m4a', '.flac', '.aac', '.ogg', '.wma']
+    audio_extensions = ['.mp3', '.wav', '.m4a', '.flac', '.aac', '.ogg', '.wma', '.opus']
     
     audio_files = []
     
@@ -157,13 +419,19 @@ def get_audio_files_from_directory(directory_path):
     
     return audio_files
 
-def append_transcription_to_file(transcription, audio_file, output_file):
-    """Append the transcription to the specified output file."""
+def append_transcription_to_file(transcription, audio_file, output_file, note=None):
+    """Append the transcription to the specified output file, with an optional note under the header."""
+    entry = (
+        f"\n\n--- Transcription of {os.path.basename(audio_file)} ---\n"
+        f"[Transcribed at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}]\n"
+        + (f"[{note}]\n" if note else "")
+        + "\n"
+        f"{transcription}"
+        "\n\n" + "-" * 80 + "\n"
+    )
+    # One write per entry so concurrent workers appending to a shared file don't interleave
     with open(output_file, 'a', encoding='utf-8') as f:
-        f.write(f"\n\n--- Transcription of {os.path.basename(audio_file)} ---\n")
-        f.write(f"[Transcribed at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}]\n\n")
-        f.write(transcription)
-        f.write("\n\n" + "-" * 80 + "\n")
+        f.write(entry)
 
 def move_processed_files(audio_files, target_directory, verbose=True):
     """
@@ -180,8 +448,8 @@ def move_processed_files(audio_files, target_directory, verbose=True):
     
     Returns:
     --------
-    moved_files : list
-        List of files that were successfully moved
+    moved_files : dict
+        Maps each file that was successfully moved to its new path
     """
     # Create the target directory if it doesn't exist
     if not os.path.exists(target_directory):
@@ -189,7 +457,7 @@ def move_processed_files(audio_files, target_directory, verbose=True):
         if verbose:
             print(f"Created directory for processed files: {target_directory}")
     
-    moved_files = []
+    moved_files = {}
     failed_moves = []
     
     if verbose:
@@ -213,7 +481,7 @@ def move_processed_files(audio_files, target_directory, verbose=True):
         try:
             # Move the file
             os.rename(audio_file, target_path)
-            moved_files.append(target_path)
+            moved_files[audio_file] = target_path
             
             if verbose:
                 print(f"Moved: {filename} -> {target_directory}")
@@ -272,6 +540,9 @@ def initialize_or_append_to_output_file(output_file, verbose=True):
         return False
 
 def main():
+    # The deadline budget counts from here when the scheduler doesn't pass one
+    run_started = time.time()
+    
     # Load configuration
     config = load_config()
     
@@ -294,6 +565,21 @@ def main():
         help="whether to print out the progress and debug messages"
     )
     
+    parser.add_argument(
+        "--calibrate", action="store_true",
+        help="time every available inference backend on this host, record the fastest in its config overlay and exit"
+    )
+    
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="number of local worker processes draining the shared queue (overrides queue.workers)"
+    )
+    parser.add_argument(
+        "--reprocess-degraded", action="store_true",
+        help="re-transcribe files that deadline mode degraded, at full quality, until the deadline, and exit"
+    )
+    parser.add_argument("--queue-child", action="store_true", help=argparse.SUPPRESS)
+    
     args = parser.parse_args()
     
     # If a different config file was specified, reload the config
@@ -309,6 +595,29 @@ def main():
     verbose = args.verbose  # Use command-line argument if provided, otherwise use config
     device = args.device    # Use command-line argument if provided, otherwise use config
     
+    # Get all audio files from the downloads directory, before any model is loaded
+    audio_files = []
+    if not args.calibrate and not args.reprocess_degraded:
+        audio_files = get_audio_files_from_directory(downloads_dir)
+        
+        if not audio_files:
+            print(f"No audio files found in {downloads_dir}. Please add audio files to this directory.")
+            sys.exit(1)
+        
+        print(f"Found {len(audio_files)} audio files in {downloads_dir}")
+    
+    # With the lease queue enabled, start extra local workers before loading the model
+    # (no more workers than there are files to share)
+    queue_config = config.get("queue", {})
+    worker_processes = []
+    if queue_config.get("enabled") and audio_files and not args.queue_child:
+        workers = args.workers if args.workers is not None else queue_config.get("workers", 1)
+        for _ in range(max(1, min(workers, len(audio_files))) - 1):
+            worker_processes.append(subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--config", args.config,
+                 "--device", args.device, "--verbose", str(args.verbose), "--queue-child"]
+            ))
+    
     transcription_config = config["transcription"]
     advanced_config = config["advanced"]
     
@@ -316,14 +625,6 @@ def main():
     if advanced_config["threads"] > 0:
         torch.set_num_threads(advanced_config["threads"])
     
-    # Process temperature
-    temperature = transcription_config["temperature"]
-    if temperature > 0:
-        # Use a tuple of temperatures increasing up to 1.0 for fallback
-        temperature = tuple(np.arange(temperature, 1.0 + 1e-6, 0.2))
-    else:
-        temperature = [temperature]
-    
     # Initialize the model
     try:
         model = load_local_model(model_folder, model_name, device)
@@ -331,6 +632,53 @@ def main():
         print(f"Error loading model: {str(e)}")
         sys.exit(1)
     
+    # Time each backend on this host and remember the fastest one
+    if args.calibrate:
+        print(f"Calibrating inference backends for {model_name} on {device}...")
+        calibration = calibrate_backends(model, model_folder, model_name, device)
+        overlay_path = host_config_path(args.config)
+        record_calibration(overlay_path, calibration)
+        print(f"Fastest backends: encoder={calibration['encoder']}, decoder={calibration['decoder']} "
+              f"(saved to {overlay_path})")
+        return
+    
+    # Backends and repetition guard; the guard's counters are shared by every model
+    repetition_stats = RepetitionStats() if config.get("repetition_guard", {}).get("enabled") else None
+    prepare_model(model, model_name, model_folder, device, config, repetition_stats, verbose)
+    
+    # Optionally pair the main model with a small draft model for assisted generation
+    speculative_stats = None
+    draft_name = config["model"].get("draft_name")
+    if draft_name:
+        try:
+            draft_model = load_local_model(model_folder, draft_name, device)
+            speculative_stats = install_speculative_decoding(
+                model, draft_model, config["model"].get("draft_tokens", 4)
+            )
+            if advanced_config["beam_size"] or transcription_config["temperature"] > 0:
+                print("Note: speculative decoding only accelerates greedy decoding (beam_size null, temperature 0)")
+        except Exception as e:
+            print(f"Error loading draft model: {str(e)}")
+            sys.exit(1)
+    
+    # Optionally route files to other checkpoints, kept resident under a memory budget
+    # (deadline mode may also step down to a smaller checkpoint)
+    routing_config = config.get("routing", {})
+    deadline_config = config.get("deadline", {})
+    router = registry = None
+    if routing_config.get("enabled") or deadline_config.get("enabled"):
+        registry = ModelRegistry(
+            model_folder, device, routing_config.get("memory_budget_mb", 4096),
+            loader=load_local_model,
+            prepare=lambda routed_model, routed_name: prepare_model(
+                routed_model, routed_name, model_folder, device, config, repetition_stats, verbose
+            ),
+        )
+        # The configured model (with its draft model, if any) stays resident
+        registry.add(model_name, model, pinned=True)
+    if routing_config.get("enabled"):
+        router = ModelRouter(routing_config.get("rules", []), model_name)
+    
     # Set English language for English-only models
     model_name_base = os.path.splitext(model_name)[0]
     language = transcription_config["language"]
@@ -341,68 +689,202 @@ def main():
             )
         language = "en"
     
-    # Get all audio files from the downloads directory
-    audio_files = get_audio_files_from_directory(downloads_dir)
-    
-    if not audio_files:
-        print(f"No audio files found in {downloads_dir}. Please add audio files to this directory.")
-        sys.exit(1)
-    
-    print(f"Found {len(audio_files)} audio files in {downloads_dir}")
+    # Decoding options shared by every file
+    decode_options = build_decode_options(config, language)
+    streaming_config = config.get("streaming", {})
+    
+    # Cycle deadline: the scheduler's, or the configured budget from the start of this run
+    deadline = cycle_deadline(deadline_config.get("budget_seconds", 3300), run_started)
+    
+    # Idle time: redo degraded files at full quality and exit
+    if args.reprocess_degraded:
+        planner = DeadlinePlanner(
+            deadline, [], deadline_config.get("assumed_rtf", 0.5), deadline_config.get("margin", 0.9)
+        )
+        reprocess_degraded(model, decode_options, streaming_config, output_file, planner, verbose)
+        return
+    
+    # Deadline mode: step down to cheaper settings when the queued audio won't fit the cycle
+    planner = None
+    audio_durations = {}
+    if deadline_config.get("enabled"):
+        planner = DeadlinePlanner(
+            deadline,
+            deadline_config.get("levels", []),
+            deadline_config.get("assumed_rtf", 0.5),
+            deadline_config.get("margin", 0.9),
+        )
+        if verbose:
+            print(f"Deadline mode: {planner.time_left() / 60:.1f} min to transcribe "
+                  f"{queued_audio_seconds(audio_files, audio_durations, ffmpeg_path) / 60:.1f} min of audio")
     
     # Keep track of successfully processed files
     processed_files = []
-    
-    # Initialize output file or prepare to append to it
-    initialize_or_append_to_output_file(output_file, verbose)
+    # (file, model, reason, audio seconds, transcription seconds) for the routing summary
+    routing_report = []
+    # Files transcribed below full quality, and where processed files were moved to
+    degraded_files = []
+    moved_paths = {}
+    
+    # Initialize output file or prepare to append to it (once per run, not per worker)
+    if not args.queue_child:
+        initialize_or_append_to_output_file(output_file, verbose)
+    
+    # Either claim files one at a time from the shared lease queue, or take them all
+    if queue_config.get("enabled"):
+        lease_queue = LeaseQueue(
+            downloads_dir,
+            lease_seconds=queue_config.get("lease_seconds", 120),
+            heartbeat_seconds=queue_config.get("heartbeat_seconds", 30),
+        )
+        jobs = lease_queue.jobs(lambda: get_audio_files_from_directory(downloads_dir))
+        if verbose:
+            print(f"Worker {lease_queue.worker_id} claiming files from the shared queue")
+    else:
+        jobs = (None for _ in audio_files)
     
     # Process each audio file
-    for i, audio_path in enumerate(audio_files, 1):
+    for i, lease in enumerate(jobs, 1):
+        audio_path = lease.audio_path if lease is not None else audio_files[i - 1]
         try:
             # Print which file we're processing
             if verbose:
                 print(f"\nProcessing file {i}/{len(audio_files)}: {os.path.basename(audio_path)}")
             
-            # Transcribe the audio
-            result = whisper.transcribe(
-                model=model,
-                audio=audio_path,
-                temperature=temperature,
-                task=transcription_config["task"],
-                language=language,
-                verbose=verbose,
-                word_timestamps=transcription_config["word_timestamps"],
-                best_of=advanced_config["best_of"],
-                beam_size=advanced_config["beam_size"],
-                patience=advanced_config["patience"],
-                length_penalty=advanced_config["length_penalty"],
-                suppress_tokens=advanced_config["suppress_tokens"],
-                initial_prompt=advanced_config["initial_prompt"],
-                condition_on_previous_text=advanced_config["condition_on_previous_text"],
-                fp16=advanced_config["fp16"],
+            # Files still waiting, including this one
+            pending = get_audio_files_from_directory(downloads_dir) if lease is not None else audio_files[i - 1:]
+            remaining = None
+            if planner is not None:
+                if lease is not None:
+                    # Files leased by other workers (on any host) are theirs; the unclaimed
+                    # ones are shared by every worker currently holding a lease
+                    leases = lease_queue.live_leases()
+                    unclaimed = [path for path in pending if os.path.basename(path) not in leases]
+                    active_workers = max(1, len(set(leases.values())))
+                    remaining = (queued_audio_seconds([audio_path], audio_durations, ffmpeg_path)
+                                 + queued_audio_seconds(unclaimed, audio_durations, ffmpeg_path) / active_workers)
+                else:
+                    remaining = queued_audio_seconds(pending, audio_durations, ffmpeg_path)
+            
+            # Routing rule and deadline level for this file
+            selection = select_model_for_file(
+                audio_path, model, model_name, decode_options, registry, router, routing_config,
+                planner, backlog=len(pending), remaining_audio=remaining, verbose=verbose,
             )
+            file_model_name, level = selection["model_name"], selection["level"]
+            
+            # Transcribe the audio
+            transcription_started = time.time()
+            result = transcribe_audio(selection["model"], audio_path, streaming_config, verbose,
+                                      selection["decode_options"])
+            transcription_finished = time.time()
+            
+            # A worker whose lease expired mid-file must leave it to the new owner,
+            # and nothing about the discarded run may be recorded
+            if lease is not None and not lease.held():
+                print(f"Lease on {os.path.basename(audio_path)} was taken over by another worker; discarding result")
+                if repetition_stats is not None:
+                    repetition_stats.discard_file()
+                continue
+            
+            if planner is not None:
+                planner.record(level, audio_durations.get(audio_path), transcription_finished - transcription_started)
+                if level:
+                    degraded_files.append({
+                        "file": os.path.basename(audio_path),
+                        "path": audio_path,
+                        "level": planner.levels[level].get("name", level),
+                        "model": file_model_name,
+                        "output_file": output_file,
+                        "transcribed_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    })
+            
+            if router is not None:
+                routing_report.append(
+                    (os.path.basename(audio_path), file_model_name, selection["reason"], selection["duration"],
+                     transcription_finished - transcription_started)
+                )
+            
+            if repetition_stats is not None:
+                steps_saved = repetition_stats.finish_file(os.path.basename(audio_path))
+                if verbose and steps_saved:
+                    print(f"Repetition guard saved up to {steps_saved} decoder steps on {os.path.basename(audio_path)}")
             
             # Extract the text from the result
             transcription_text = result["text"]
             
             # Append to the combined output file
-            append_transcription_to_file(transcription_text, audio_path, output_file)
+            append_transcription_to_file(
+                transcription_text, audio_path, output_file,
+                note="Degraded to meet the cycle deadline; will be re-transcribed at full quality" if level else None
+            )
             
             # Add to list of successfully processed files
             processed_files.append(audio_path)
             
+            # Log upload -> transcript latency for this file (before it is moved)
+            timing = record_transcription(audio_path, transcription_started, transcription_finished, time.time())
+            
             if verbose:
                 print(f"Transcription of {os.path.basename(audio_path)} appended to {output_file}")
+                if timing["end_to_end"] is not None:
+                    print(f"End-to-end latency: {timing['end_to_end']:.1f}s "
+                          f"(queue wait {timing['queue_wait']:.1f}s, transcription {timing['transcription_time']:.1f}s)")
+            
+            # Leased files are moved while the lease is still held, so no other worker races us
+            if lease is not None:
+                if lease.held():
+                    moved_paths.update(move_processed_files([audio_path], processed_dir, verbose))
+                else:
+                    print(f"Lease on {os.path.basename(audio_path)} was taken over by another worker; not moving it")
                 
         except Exception as e:
             traceback.print_exc()
             print(f"Skipping {audio_path} due to {type(e).__name__}: {str(e)}")
+        finally:
+            if lease is not None:
+                lease.release()
     
     # Move successfully processed files to the processed directory
-    if processed_files:
-        move_processed_files(processed_files, processed_dir, verbose)
+    if processed_files and not queue_config.get("enabled"):
+        moved_paths.update(move_processed_files(processed_files, processed_dir, verbose))
+    
+    # Remember degraded files (by their archived path) for reprocessing when idle
+    if degraded_files:
+        for entry in degraded_files:
+            entry["path"] = moved_paths.get(entry["path"], entry["path"])
+        log_degraded(degraded_files)
+        print(f"\nDeadline mode: {len(degraded_files)} files transcribed below full quality, "
+              f"logged to {DEGRADED_LOG} for reprocessing")
+    
+    if speculative_stats is not None and speculative_stats.proposed:
+        print(
+            f"\nSpeculative decoding: {speculative_stats.accepted}/{speculative_stats.proposed} draft tokens accepted "
+            f"({speculative_stats.acceptance_rate:.1%}), {speculative_stats.tokens_per_pass:.2f} tokens per main-model pass"
+        )
+    
+    if routing_report:
+        print("\nModel routing summary:")
+        for file_name, routed_model, reason, duration, seconds in routing_report:
+            cost = f"{seconds:.1f}s"
+            if duration:
+                cost += f" for {duration:.1f}s of audio (RTF {seconds / duration:.2f})"
+            print(f"  {file_name} -> {routed_model} [{reason}]: {cost}")
+        print(f"  {registry.loads} model loads, {registry.evictions} evictions, "
+              f"{registry.used_bytes / 1e6:.0f} MB resident of {registry.budget_bytes / 1e6:.0f} MB budget")
+    
+    if repetition_stats is not None and repetition_stats.windows_aborted:
+        print(
+            f"\nRepetition guard: {repetition_stats.windows_aborted} looping windows stopped early, "
+            f"up to {repetition_stats.steps_saved} decoder steps saved"
+        )
+    
+    for worker in worker_processes:
+        worker.wait()
     
     print(f"\nAll transcriptions have been appended to {output_file}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    # Background jobs (e.g. archive_transcoder.py) yield while any transcriber runs
+    with transcribing():
+        main() 
\ No newline at end of file
@@ -0,0 +1,178 @@
+"""
+Model Registry - several local checkpoints under one memory budget
+
+ModelRegistry keeps models from ./model resident in least-recently-used order
+and evicts the oldest ones when loading another would exceed the configured
+memory budget. ModelRouter picks a checkpoint per file from rules on the
+recording's duration, its detected language and the current backlog, so a short
+memo doesn't have to pay for the largest model.
+"""
+
+import gc
+import os
+from collections import OrderedDict
+
+import torch
+from whisper.audio import N_SAMPLES, log_mel_spectrogram, pad_or_trim
+
+from streaming_audio import PCMStream
+
+
+def model_size_bytes(model):
+    """Memory taken by a model's parameters and buffers."""
+    return sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+
+
+def estimate_model_bytes(checkpoint_path):
+    """
+    Memory a checkpoint will take once loaded. Whisper checkpoints store fp16
+    weights but load into an fp32 model, so this is about twice the file size.
+    """
+    try:
+        # Memory-mapped, so only the tensor metadata is read
+        checkpoint = torch.load(checkpoint_path, map_location="cpu", mmap=True)
+        return sum(t.numel() * 4 for t in checkpoint["model_state_dict"].values())
+    except Exception:
+        return 2 * os.path.getsize(checkpoint_path)
+
+
+class ModelRegistry:
+    """
+    LRU cache of loaded models bounded by a memory budget.
+
+    Parameters:
+    -----------
+    model_folder : str
+        Folder containing the .pt checkpoints
+    device : str
+        Device the models are loaded onto
+    memory_budget_mb : float
+        Upper bound on the summed size of resident models
+    loader : callable
+        loader(model_folder, model_name, device) -> model
+    prepare : callable, optional
+        prepare(model, model_name) -> model, run once after each load
+    """
+
+    def __init__(self, model_folder, device, memory_budget_mb, loader, prepare=None):
+        self.model_folder = model_folder
+        self.device = device
+        self.budget_bytes = memory_budget_mb * 1024 * 1024
+        self.loader = loader
+        self.prepare = prepare
+        self.models = OrderedDict()
+        self.sizes = {}
+        self.pinned = set()
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def used_bytes(self):
+        return sum(self.sizes.values())
+
+    def add(self, model_name, model, pinned=False):
+        """Register an already loaded model, optionally exempt from eviction."""
+        self.models[model_name] = model
+        self.sizes[model_name] = model_size_bytes(model)
+        if pinned:
+            self.pinned.add(model_name)
+
+    def _evict_for(self, needed_bytes, keep=None):
+        for name in list(self.models):
+            if self.used_bytes + needed_bytes <= self.budget_bytes:
+                return
+            if name in self.pinned or name == keep:
+                continue
+            print(f"Evicting {name} from memory ({self.sizes[name] / 1e6:.0f} MB)")
+            del self.models[name]
+            del self.sizes[name]
+            self.evictions += 1
+
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def get(self, model_name):
+        """Return a resident model, loading it (and evicting others) if needed."""
+        if model_name in self.models:
+            self.models.move_to_end(model_name)
+            return self.models[model_name]
+
+        checkpoint_path = os.path.join(self.model_folder, model_name)
+        estimate = estimate_model_bytes(checkpoint_path) if os.path.isfile(checkpoint_path) else 0
+        self._evict_for(estimate)
+
+        model = self.loader(self.model_folder, model_name, self.device)
+        if self.prepare is not None:
+            model = self.prepare(model, model_name)
+        self.add(model_name, model)
+        self.loads += 1
+
+        # The estimate can be off (e.g. a draft model or backend adds weights): evict again by the measured size
+        self._evict_for(0, keep=model_name)
+        if self.used_bytes > self.budget_bytes:
+            print(f"Warning: loading {model_name} exceeds the memory budget of {self.budget_bytes / 1e6:.0f} MB")
+        return model
+
+
+class ModelRouter:
+    """
+    Route each file to a model with the first matching rule.
+
+    A rule is a dict with a "model" and any of the conditions
+    min_duration / max_duration (seconds), language (code or list of codes),
+    min_backlog / max_backlog (files still waiting, including this one).
+    A condition whose input is unknown (e.g. duration could not be probed)
+    does not match. Files matching no rule use the default model.
+    """
+
+    def __init__(self, rules, default_model):
+        self.rules = rules
+        self.default_model = default_model
+
+    @property
+    def needs_language(self):
+        return any("language" in rule for rule in self.rules)
+
+    @staticmethod
+    def _matches(rule, duration, language, backlog):
+        def within(value, low_key, high_key):
+            if low_key not in rule and high_key not in rule:
+                return True
+            if value is None:
+                return False
+            return rule.get(low_key, float("-inf")) <= value <= rule.get(high_key, float("inf"))
+
+        if "language" in rule:
+            languages = rule["language"] if isinstance(rule["language"], list) else [rule["language"]]
+            if language not in languages:
+                return False
+
+        return (
+            within(duration, "min_duration", "max_duration")
+            and within(backlog, "min_backlog", "max_backlog")
+        )
+
+    def route(self, duration=None, language=None, backlog=None):
+        """Return (model_name, reason) for a file."""
+        for i, rule in enumerate(self.rules):
+            if self._matches(rule, duration, language, backlog):
+                conditions = ", ".join(f"{k}={v}" for k, v in rule.items() if k != "model")
+                return rule["model"], f"rule {i + 1} ({conditions or 'always'})"
+        return self.default_model, "default"
+
+
+def detect_language(model, audio_path, ffmpeg_path="ffmpeg"):
+    """Detect the spoken language from the first 30 seconds, without decoding the whole file."""
+    if not model.is_multilingual:
+        return "en"
+
+    stream = PCMStream(audio_path, ffmpeg_path, block_samples=N_SAMPLES)
+    try:
+        audio = stream.read(N_SAMPLES).copy()
+    finally:
+        stream.close(check=False)
+
+    mel = log_mel_spectrogram(pad_or_trim(audio), model.dims.n_mels).to(model.device)
+    _, probs = model.detect_language(mel)
+    return max(probs, key=probs.get)
@@ -0,0 +1,205 @@
+"""
+Pipeline Timing
+
+Tracks each recording from Google Drive upload to transcript availability.
+
+- download-from-gdrive.py records the file's Drive createdTime and when the
+  download finished in a small sidecar file (downloads/.timing/<name>.json)
+- local_whisper.py adds when transcription started, how long it took and when
+  the text was appended, then writes one JSON line per file to the latency log
+- scheduler.py feeds new latency log lines into a LatencyTracker, which keeps
+  rolling p50/p95/p99 statistics and exports them to a metrics file
+
+All times are Unix timestamps (seconds).
+"""
+
+import json
+import math
+import os
+import time
+from collections import deque
+from datetime import datetime
+
+TIMING_DIRECTORY = '.timing'
+LATENCY_LOG = 'pipeline_latency.jsonl'
+METRICS_FILE = 'pipeline_metrics.json'
+
+def parse_drive_time(value):
+    """Convert a Drive RFC 3339 timestamp (e.g. 2025-03-21T18:08:07.123Z) to a Unix timestamp"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+def _sidecar_path(audio_path):
+    directory, name = os.path.split(audio_path)
+    return os.path.join(directory, TIMING_DIRECTORY, name + '.json')
+
+def record_download(audio_path, drive_created_time, downloaded_at=None):
+    """Remember when a file was uploaded to Drive and when it finished downloading"""
+    sidecar_path = _sidecar_path(audio_path)
+    os.makedirs(os.path.dirname(sidecar_path), exist_ok=True)
+    with open(sidecar_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "created": parse_drive_time(drive_created_time),
+            "downloaded": downloaded_at if downloaded_at is not None else time.time(),
+        }, f)
+
+def load_file_timing(audio_path):
+    """
+    Return the download-side timing of a file. Files that were not fetched by
+    the downloader fall back to their modification time as the download time.
+    """
+    try:
+        with open(_sidecar_path(audio_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        try:
+            downloaded = os.path.getmtime(audio_path)
+        except OSError:
+            downloaded = None
+        return {"created": None, "downloaded": downloaded}
+
+def record_transcription(audio_path, transcription_started, transcription_finished, appended_at,
+                         latency_log=LATENCY_LOG):
+    """
+    Complete a file's timing record, append it to the latency log and drop its sidecar.
+
+    Returns:
+    --------
+    dict
+        The full record that was logged
+    """
+    timing = load_file_timing(audio_path)
+    created, downloaded = timing.get("created"), timing.get("downloaded")
+
+    record = {
+        "file": os.path.basename(audio_path),
+        "created": created,
+        "downloaded": downloaded,
+        "transcription_started": transcription_started,
+        "appended": appended_at,
+        "download_delay": downloaded - created if created is not None and downloaded is not None else None,
+        "queue_wait": transcription_started - downloaded if downloaded is not None else None,
+        "transcription_time": transcription_finished - transcription_started,
+        "append_time": appended_at - transcription_finished,
+        "end_to_end": appended_at - created if created is not None else None,
+    }
+
+    with open(latency_log, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + "\n")
+
+    try:
+        os.remove(_sidecar_path(audio_path))
+    except OSError:
+        pass
+
+    return record
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+class LatencyTracker:
+    """
+    Rolling latency statistics over the most recent ``window`` files.
+
+    Parameters:
+    -----------
+    latency_log : str
+        JSON-lines file written by local_whisper.py; only new lines are read each time
+    window : int
+        Number of most recent files the percentiles are computed over
+    """
+
+    STAGES = ("end_to_end", "download_delay", "queue_wait", "transcription_time", "append_time")
+
+    def __init__(self, latency_log=LATENCY_LOG, window=500):
+        self.latency_log = latency_log
+        self.samples = {stage: deque(maxlen=window) for stage in self.STAGES}
+        self.files_seen = 0
+        # Start from the end of an existing log so old runs don't skew the window
+        self._offset = os.path.getsize(latency_log) if os.path.exists(latency_log) else 0
+
+    def update(self):
+        """Read records appended since the last call; returns how many were added"""
+        if not os.path.exists(self.latency_log):
+            return 0
+        if os.path.getsize(self.latency_log) < self._offset:
+            # The log was rotated or truncated
+            self._offset = 0
+
+        added = 0
+        with open(self.latency_log, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # A writer is mid-line; pick it up next time
+                    break
+                self._offset += len(line)
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    continue
+                for stage in self.STAGES:
+                    if record.get(stage) is not None:
+                        self.samples[stage].append(record[stage])
+                added += 1
+
+        self.files_seen += added
+        return added
+
+    def summary(self, downloads_dir=None):
+        """Percentiles per stage plus the age of the oldest recording still waiting"""
+        stats = {}
+        for stage, values in self.samples.items():
+            ordered = sorted(values)
+            stats[stage] = {
+                "count": len(ordered),
+                "p50": percentile(ordered, 0.50),
+                "p95": percentile(ordered, 0.95),
+                "p99": percentile(ordered, 0.99),
+                "max": ordered[-1] if ordered else None,
+            }
+
+        return {
+            "updated": time.time(),
+            "files_seen": self.files_seen,
+            "latency_seconds": stats,
+            "backlog": backlog_stats(downloads_dir) if downloads_dir else None,
+        }
+
+    def export(self, metrics_file=METRICS_FILE, downloads_dir=None):
+        """Write the current summary atomically to ``metrics_file`` and return it"""
+        summary = self.summary(downloads_dir)
+        temp_path = metrics_file + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        os.replace(temp_path, metrics_file)
+        return summary
+
+def backlog_stats(downloads_dir, audio_extensions=('.mp3', '.wav', '.m4a', '.flac', '.aac', '.ogg', '.wma', '.opus')):
+    """Number of recordings waiting in the downloads directory and how old the oldest one is"""
+    if not os.path.isdir(downloads_dir):
+        return {"files": 0, "oldest_age_seconds": None, "median_age_seconds": None}
+
+    now = time.time()
+    ages = []
+    for name in os.listdir(downloads_dir):
+        audio_path = os.path.join(downloads_dir, name)
+        if not (os.path.isfile(audio_path) and name.lower().endswith(audio_extensions)):
+            continue
+        timing = load_file_timing(audio_path)
+        # Age is measured from the Drive upload when we know it
+        since = timing.get("created") or timing.get("downloaded")
+        if since is not None:
+            ages.append(now - since)
+
+    ages.sort()
+    return {
+        "files": len(ages),
+        "oldest_age_seconds": ages[-1] if ages else None,
+        "median_age_seconds": percentile(ages, 0.50),
+    }
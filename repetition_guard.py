@@ -0,0 +1,153 @@
+"""
+Repetition Guard - stop runaway decoding loops as they happen
+
+On silent or noisy stretches Whisper often falls into a loop, repeating the
+same phrase until the token limit; only then does transcribe()'s
+compression_ratio check reject the window and try the next temperature. The
+guard watches the tokens as they are generated and, as soon as the tail of a
+sequence is one n-gram repeated over and over, forces end-of-text. The
+window's result is then marked so transcribe() either falls back to the next
+temperature straight away or, when there is no higher temperature left to try,
+skips the window as non-speech.
+"""
+
+from dataclasses import dataclass, field, replace
+from typing import Dict
+
+import numpy as np
+
+from whisper.decoding import LogitFilter
+
+from decoding_hooks import install_decoding_hooks
+
+
+@dataclass
+class RepetitionStats:
+    """Loops caught, and decoder steps they would otherwise have run, per file."""
+    windows_aborted: int = 0
+    # Upper bound: a caught loop is assumed to have run on to the token limit
+    steps_saved: int = 0
+    per_file: Dict[str, int] = field(default_factory=dict)
+    _reported: int = 0
+    _reported_windows: int = 0
+
+    def finish_file(self, file_name):
+        """Record the steps saved since the previous file and return them."""
+        saved = self.steps_saved - self._reported
+        self._reported = self.steps_saved
+        self._reported_windows = self.windows_aborted
+        self.per_file[file_name] = saved
+        return saved
+
+    def discard_file(self):
+        """Forget what was counted since the previous file, whose result was thrown away."""
+        self.steps_saved = self._reported
+        self.windows_aborted = self._reported_windows
+
+
+class RepetitionDetector:
+    """
+    Decide whether a token sequence has fallen into a loop.
+
+    The tail of the sequence counts as a loop when an n-gram of ``n`` text
+    tokens (1 <= n <= max_ngram) repeats back to back at least ``min_repeats``
+    times and the repeated span covers at least ``min_span_tokens`` tokens.
+    Timestamp tokens are ignored, since a looping segment still gets new
+    timestamps on every repetition.
+    """
+
+    def __init__(self, timestamp_begin, max_ngram=8, min_repeats=4, min_span_tokens=16):
+        self.timestamp_begin = timestamp_begin
+        self.max_ngram = max_ngram
+        self.min_repeats = min_repeats
+        self.min_span_tokens = min_span_tokens
+
+    def is_looping(self, tokens):
+        text_tokens = [t for t in tokens if t < self.timestamp_begin]
+
+        for n in range(1, self.max_ngram + 1):
+            repeats = max(self.min_repeats, -(-self.min_span_tokens // n))
+            span = n * repeats
+            if len(text_tokens) < span:
+                continue
+            tail = text_tokens[-span:]
+            if all(tail[i] == tail[i - n] for i in range(n, span)):
+                return True
+
+        return False
+
+
+class RepetitionAbortFilter(LogitFilter):
+    """Force end-of-text on any sequence the detector reports as looping."""
+
+    def __init__(self, detector, eot, sample_begin):
+        self.detector = detector
+        self.eot = eot
+        self.sample_begin = sample_begin
+
+    def apply(self, logits, tokens):
+        for k in range(tokens.shape[0]):
+            if self.detector.is_looping(tokens[k, self.sample_begin:].tolist()):
+                logits[k, :] = -np.inf
+                logits[k, self.eot] = 0
+
+
+def install_repetition_guard(model, max_ngram=8, min_repeats=4, min_span_tokens=16, action="fallback", stats=None,
+                             max_temperature=1.0):
+    """
+    Abort looping windows early in every ``model.decode`` call.
+
+    Parameters:
+    -----------
+    model : whisper.model.Whisper
+        The model used by whisper.transcribe
+    max_ngram, min_repeats, min_span_tokens : int
+        Detection thresholds, see RepetitionDetector
+    action : str
+        "fallback" retries the window at the next temperature immediately, or
+        skips it once ``max_temperature`` is reached; "skip" drops the window as
+        if it were silence
+    stats : RepetitionStats, optional
+        Counters to update, so several models can share one set
+    max_temperature : float
+        Last temperature transcribe() tries, e.g. 0 when temperature fallback is off
+
+    Returns:
+    --------
+    stats : RepetitionStats
+        Counters updated as windows are decoded
+    """
+    if action not in ("fallback", "skip"):
+        raise ValueError(f"Unknown repetition guard action '{action}'. Choose 'fallback' or 'skip'.")
+
+    stats = stats if stats is not None else RepetitionStats()
+    setup = install_decoding_hooks(model)
+
+    def add_filter(task):
+        task.repetition_detector = RepetitionDetector(
+            task.tokenizer.timestamp_begin, max_ngram, min_repeats, min_span_tokens
+        )
+        # Appended last so nothing after it can re-enable other tokens
+        task.logit_filters.append(
+            RepetitionAbortFilter(task.repetition_detector, task.tokenizer.eot, task.sample_begin)
+        )
+
+    def mark_results(task, results):
+        marked = []
+        for result in results:
+            if task.repetition_detector.is_looping(result.tokens):
+                stats.windows_aborted += 1
+                stats.steps_saved += max(0, task.sample_len - len(result.tokens))
+                if action == "fallback" and task.options.temperature < max_temperature:
+                    # Guarantees transcribe() sees needs_fallback for this temperature
+                    result = replace(result, compression_ratio=float("inf"))
+                else:
+                    # Treated as no speech: no fallback, and the window is skipped.
+                    # At the last temperature a fallback would keep the loop's text
+                    result = replace(result, no_speech_prob=1.0, avg_logprob=float("-inf"))
+            marked.append(result)
+        return marked
+
+    setup.task_hooks.append(add_filter)
+    setup.result_hooks.append(mark_results)
+    return stats
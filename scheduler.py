@@ -6,18 +6,31 @@ This script runs three operations sequentially every minute:
 2. download-from-gdrive.py - Downloads audio files from Google Drive
 3. local_whisper.py - Transcribes the downloaded audio files
 
+The transcription step is told when the cycle should end, so deadline mode can
+degrade decoding to keep up. If the cycle ends early and nothing is waiting, the
+spare time is used to re-transcribe degraded files at full quality.
+
+After each cycle it starts archive_transcoder.py in the background (if it is not
+already running) to compress processed recordings at idle priority.
+
 Author: [Your Name]
 Date: [Current Date]
 """
 
 import subprocess
 import time
+import json
 import logging
 import os
+import re
 import sys
+import threading
 import traceback
+from collections import deque
 from datetime import datetime
 from update_config_date import update_output_filename
+from pipeline_timing import LatencyTracker, LATENCY_LOG, METRICS_FILE, backlog_stats
+from cycle_deadline import DEADLINE_ENV, load_degraded
 # Import the FFmpeg path setup function
 from ffmpeg_utils import setup_ffmpeg_path
 
@@ -40,6 +53,7 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 # Path to the scripts to run (use absolute paths for reliability)
 DOWNLOAD_SCRIPT_PATH = os.path.join(SCRIPT_DIR, 'download-from-gdrive.py')
 WHISPER_SCRIPT_PATH = os.path.join(SCRIPT_DIR, 'local_whisper.py')
+TRANSCODER_SCRIPT_PATH = os.path.join(SCRIPT_DIR, 'archive_transcoder.py')
 
 # Get the path to the Python executable that's running this script
 # This ensures we use the same Python environment with all installed packages
@@ -48,8 +62,71 @@ PYTHON_EXECUTABLE = sys.executable
 # Interval in seconds (60 seconds = 1 minute)
 INTERVAL = 3600
 
-def run_pipeline():
-    """Run the complete pipeline: update config date, download files, transcribe audio"""
+# Child output is relayed line by line; longer lines are split at this many characters
+MAX_LINE_CHARS = 4096
+# Number of recent stderr lines kept to repeat in the log if a script fails
+ERROR_TAIL_LINES = 50
+# Spare time a cycle must have left before degraded files are reprocessed
+IDLE_REPROCESS_MIN_SECONDS = 600
+# tqdm bars (" 45%|####5     | 1350/3000 [00:10<00:12, ...]") and the downloader's progress lines
+PROGRESS_NOISE = re.compile(r'^\s*(\d+%\|.*\|.*|Download progress: \d+%)\s*$')
+
+def relay_stream(stream, script_name, level, tail=None):
+    """Log each line of a child's output stream as it arrives, dropping progress-bar noise"""
+    while True:
+        # Text mode splits on '\r' too, so every tqdm redraw arrives as its own line
+        line = stream.readline(MAX_LINE_CHARS)
+        if not line:
+            break
+        line = line.rstrip()
+        if not line or PROGRESS_NOISE.match(line):
+            continue
+        logging.log(level, f"[{script_name}] {line}")
+        if tail is not None:
+            tail.append(line)
+    stream.close()
+
+def run_script(script_path, script_name, args=(), extra_env=None):
+    """
+    Run a pipeline script, relaying its stdout (INFO) and stderr (WARNING) live
+    into the scheduler log. Only a bounded tail of stderr is kept in memory.
+    
+    Returns the script's exit code.
+    """
+    # Unbuffered children so progress shows up in the log as it happens
+    env = dict(os.environ, PYTHONUNBUFFERED='1', **(extra_env or {}))
+    process = subprocess.Popen(
+        [PYTHON_EXECUTABLE, script_path, *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding='utf-8',  # Explicitly set encoding to utf-8
+        errors='replace',  # Replace characters that can't be decoded
+        env=env
+    )
+    
+    error_tail = deque(maxlen=ERROR_TAIL_LINES)
+    stderr_thread = threading.Thread(
+        target=relay_stream,
+        args=(process.stderr, script_name, logging.WARNING, error_tail),
+        daemon=True
+    )
+    stderr_thread.start()
+    relay_stream(process.stdout, script_name, logging.INFO)
+    stderr_thread.join()
+    
+    returncode = process.wait()
+    if returncode != 0:
+        logging.error(f"{script_name} failed with exit code {returncode}")
+        if error_tail:
+            logging.error("Error output (last lines):\n" + "\n".join(error_tail))
+    return returncode
+
+def run_pipeline(deadline=None):
+    """
+    Run the complete pipeline: update config date, download files, transcribe audio.
+    ``deadline`` (Unix time) is when the cycle should be finished.
+    """
     logging.info("Starting pipeline execution")
     
     # Step 1: Update config file with current date
@@ -59,46 +136,78 @@ def run_pipeline():
     
     # Step 2: Download files from Google Drive
     logging.info("Step 2: Downloading files from Google Drive")
-    try:
-        download_process = subprocess.run(
-            [PYTHON_EXECUTABLE, DOWNLOAD_SCRIPT_PATH],
-            check=True,
-            capture_output=True,
-            text=True,
-            encoding='utf-8',  # Explicitly set encoding to utf-8
-            errors='replace'   # Replace characters that can't be decoded
-        )
-        logging.info(f"Download script output: {download_process.stdout}")
-        if download_process.stderr:
-            logging.warning(f"Download script errors: {download_process.stderr}")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Download script failed with exit code {e.returncode}")
-        logging.error(f"Error output: {e.stderr}")
-        # Continue to transcription anyway - there might be previously downloaded files
+    # Continue to transcription even on failure - there might be previously downloaded files
+    run_script(DOWNLOAD_SCRIPT_PATH, "Download script")
     
     # Step 3: Transcribe downloaded audio files
     logging.info("Step 3: Transcribing audio files")
+    run_script(
+        WHISPER_SCRIPT_PATH, "Transcription script",
+        extra_env={DEADLINE_ENV: str(deadline)} if deadline else None
+    )
+    
+    logging.info("Pipeline execution completed")
+
+def get_downloads_directory():
+    """Read downloads_directory from config.json, falling back to the default"""
+    try:
+        with open('config.json', 'r', encoding='utf-8') as f:
+            return json.load(f).get('downloads_directory', './downloads')
+    except (OSError, json.JSONDecodeError):
+        return './downloads'
+
+def report_latency(tracker):
+    """Fold this cycle's per-file timings into the rolling stats and export them"""
     try:
-        whisper_process = subprocess.run(
-            [PYTHON_EXECUTABLE, WHISPER_SCRIPT_PATH],
-            check=True,
-            capture_output=True,
-            text=True,
-            encoding='utf-8',  # Explicitly set encoding to utf-8
-            errors='replace'   # Replace characters that can't be decoded
+        tracker.update()
+        summary = tracker.export(METRICS_FILE, get_downloads_directory())
+    except Exception as e:
+        logging.error(f"Failed to update latency metrics: {str(e)}")
+        return
+    
+    end_to_end = summary["latency_seconds"]["end_to_end"]
+    if end_to_end["count"]:
+        logging.info(
+            f"End-to-end latency over last {end_to_end['count']} files: "
+            f"p50 {end_to_end['p50']:.0f}s, p95 {end_to_end['p95']:.0f}s, p99 {end_to_end['p99']:.0f}s"
         )
-        logging.info(f"Transcription script output: {whisper_process.stdout}")
-        if whisper_process.stderr:
-            logging.warning(f"Transcription script errors: {whisper_process.stderr}")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Transcription script failed with exit code {e.returncode}")
-        logging.error(f"Error output: {e.stderr}")
+    backlog = summary["backlog"]
+    if backlog and backlog["files"]:
+        logging.info(f"Backlog: {backlog['files']} files, oldest waiting {backlog['oldest_age_seconds']:.0f}s")
+
+def reprocess_degraded_files(deadline):
+    """Use the rest of an idle cycle to re-transcribe degraded files at full quality"""
+    if deadline - time.time() < IDLE_REPROCESS_MIN_SECONDS or not load_degraded():
+        return
+    backlog = backlog_stats(get_downloads_directory())
+    if backlog["files"]:
+        return
     
-    logging.info("Pipeline execution completed")
+    logging.info("Idle until the next cycle, reprocessing degraded transcriptions at full quality")
+    run_script(
+        WHISPER_SCRIPT_PATH, "Reprocessing",
+        args=["--reprocess-degraded"], extra_env={DEADLINE_ENV: str(deadline)}
+    )
+
+def start_archive_transcoder(transcoder_process):
+    """Start the background archive transcoder unless the previous one is still running"""
+    if transcoder_process is not None and transcoder_process.poll() is None:
+        logging.info("Archive transcoder still running from a previous cycle")
+        return transcoder_process
+    
+    logging.info("Starting background archive transcoder")
+    # It logs to archive_transcoder.log itself and lowers its own priority
+    return subprocess.Popen(
+        [PYTHON_EXECUTABLE, TRANSCODER_SCRIPT_PATH],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
 
 def main():
     """Main function to run the scheduler"""
     logging.info("Audio Pipeline Scheduler started")
+    transcoder_process = None
+    latency_tracker = LatencyTracker(LATENCY_LOG)
     
     try:
         while True:
@@ -106,8 +215,18 @@ def main():
             cycle_start = datetime.now()
             logging.info(f"Starting pipeline cycle at {cycle_start.strftime('%Y-%m-%d %H:%M:%S')}")
             
-            # Run the pipeline
-            run_pipeline()
+            # Run the pipeline, which should finish before the next cycle starts
+            deadline = cycle_start.timestamp() + INTERVAL
+            run_pipeline(deadline)
+            
+            # Update rolling latency percentiles and export them
+            report_latency(latency_tracker)
+            
+            # Spare time before the next cycle goes to full-quality reprocessing
+            reprocess_degraded_files(deadline)
+            
+            # Compress the archive in the background until the next cycle
+            transcoder_process = start_archive_transcoder(transcoder_process)
             
             # Calculate time for next cycle
             elapsed = (datetime.now() - cycle_start).total_seconds()
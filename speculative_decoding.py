@@ -0,0 +1,250 @@
+"""
+Speculative Decoding - assisted generation for the local Whisper models
+
+A small draft checkpoint (e.g. tiny.pt) proposes several tokens at a time and the
+main checkpoint verifies all of them in a single forward pass. Proposals are only
+kept while they match the main model's own greedy choice, so the transcript is the
+one the main model would produce on its own, up to numerical noise: verification
+scores several tokens per pass with its own attention code rather than Whisper's
+one token at a time (which may use SDPA), and where two tokens are nearly tied the
+tiny difference in logits can flip the greedy choice. `benchmark.py speculative`
+measures how far the two paths' logits drift apart.
+
+Only greedy decoding (temperature 0, no beam search) is accelerated. Beam search
+and sampling fall back to Whisper's regular decoding loop unchanged.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from whisper.decoding import DecodingTask, GreedyDecoder
+
+from decoding_hooks import install_decoding_hooks
+
+
+@dataclass
+class SpeculativeStats:
+    """Counters accumulated over every window decoded with the draft model."""
+    windows: int = 0
+    tokens: int = 0
+    proposed: int = 0
+    accepted: int = 0
+    main_passes: int = 0
+
+    @property
+    def acceptance_rate(self):
+        return self.accepted / self.proposed if self.proposed else 0.0
+
+    @property
+    def tokens_per_pass(self):
+        return self.tokens / self.main_passes if self.main_passes else 0.0
+
+
+def _attention(attn, q, k, v, mask=None):
+    """Whisper's MultiHeadAttention.qkv_attention without SDPA, with a full (n_q, n_k) mask."""
+    n_head = attn.n_head
+    scale = (q.shape[-1] // n_head) ** -0.25
+    q = q.view(*q.shape[:2], n_head, -1).permute(0, 2, 1, 3) * scale
+    k = k.view(*k.shape[:2], n_head, -1).permute(0, 2, 3, 1) * scale
+    v = v.view(*v.shape[:2], n_head, -1).permute(0, 2, 1, 3)
+
+    qk = q @ k
+    if mask is not None:
+        qk = qk + mask
+    w = F.softmax(qk.float(), dim=-1).to(q.dtype)
+    return attn.out((w @ v).permute(0, 2, 1, 3).flatten(start_dim=2))
+
+
+class _IncrementalDecoder:
+    """
+    Run a Whisper text decoder over a growing token prefix.
+
+    Whisper's own kv_cache hooks assume one new token per forward pass once the
+    cache is warm, which is exactly what verification breaks. This keeps the
+    self-attention keys/values per block and masks several new tokens correctly
+    against the cached prefix. Setting ``length`` to a smaller value rolls the
+    cache back to that prefix.
+    """
+
+    def __init__(self, model, audio_features):
+        self.decoder = model.decoder
+        self.dtype = audio_features.dtype
+        self.length = 0
+        self.self_kv = [None] * len(self.decoder.blocks)
+        self.cross_kv = [
+            (block.cross_attn.key(audio_features), block.cross_attn.value(audio_features))
+            if block.cross_attn is not None else None
+            for block in self.decoder.blocks
+        ]
+
+    def __call__(self, tokens):
+        decoder = self.decoder
+        offset, n_tokens = self.length, tokens.shape[-1]
+
+        x = decoder.token_embedding(tokens) + decoder.positional_embedding[offset : offset + n_tokens]
+        x = x.to(self.dtype)
+
+        # Token i sits at absolute position offset + i and may see everything up to it
+        mask = torch.full((n_tokens, offset + n_tokens), float("-inf"), device=x.device).triu_(offset + 1)
+
+        for i, block in enumerate(decoder.blocks):
+            h = block.attn_ln(x)
+            key, value = block.attn.key(h), block.attn.value(h)
+            if offset:
+                past_key, past_value = self.self_kv[i]
+                key = torch.cat([past_key[:, :offset], key], dim=1)
+                value = torch.cat([past_value[:, :offset], value], dim=1)
+            self.self_kv[i] = (key, value)
+            x = x + _attention(block.attn, block.attn.query(h), key, value, mask)
+
+            if self.cross_kv[i] is not None:
+                h = block.cross_attn_ln(x)
+                x = x + _attention(block.cross_attn, block.cross_attn.query(h), *self.cross_kv[i])
+
+            x = x + block.mlp(block.mlp_ln(x))
+
+        x = decoder.ln(x)
+        self.length = offset + n_tokens
+        return (x @ torch.transpose(decoder.token_embedding.weight.to(x.dtype), 0, 1)).float()
+
+
+class SpeculativeDecodingTask(DecodingTask):
+    """DecodingTask whose greedy main loop is driven by draft-model proposals."""
+
+    def __init__(self, model, options, draft_model, n_draft_tokens=4, stats=None):
+        super().__init__(model, options)
+        self.draft_model = draft_model
+        self.n_draft_tokens = n_draft_tokens
+        self.stats = stats if stats is not None else SpeculativeStats()
+        self.draft_audio_features = None
+
+    def _get_audio_features(self, mel):
+        audio_features = super()._get_audio_features(mel)
+
+        # The draft model needs its own encoder output; skip drafting if we were
+        # handed precomputed features instead of a mel spectrogram
+        if mel.shape[-2:] != (self.model.dims.n_audio_ctx, self.model.dims.n_audio_state):
+            self.draft_audio_features = self.draft_model.embed_audio(mel.to(audio_features.dtype))
+
+        return audio_features
+
+    def _main_loop(self, audio_features, tokens):
+        if (
+            self.draft_audio_features is None
+            or tokens.shape[0] != 1
+            or not isinstance(self.decoder, GreedyDecoder)
+            or self.decoder.temperature > 0
+        ):
+            return super()._main_loop(audio_features, tokens)
+
+        sum_logprobs = torch.zeros(1, device=audio_features.device)
+        no_speech_probs = [np.nan]
+
+        main = _IncrementalDecoder(self.model, audio_features)
+        draft = _IncrementalDecoder(self.draft_model, self.draft_audio_features)
+
+        n_generated = 0
+        done = False
+        self.stats.windows += 1
+
+        while not done:
+            # Keep proposals + the bonus token within sample_len and the positional table
+            n_draft = max(0, min(
+                self.n_draft_tokens,
+                self.sample_len - n_generated - 1,
+                self.n_ctx - tokens.shape[-1],
+            ))
+            proposals = self._propose(draft, tokens, n_draft)
+            n_draft = proposals.shape[-1]
+
+            # One main-model pass scores the pending token(s) and every proposal
+            first_pass = main.length == 0
+            pending = tokens[:, main.length:]
+            logits = main(torch.cat([pending, proposals], dim=-1))
+            self.stats.main_passes += 1
+            self.stats.proposed += n_draft
+
+            if first_pass and self.tokenizer.no_speech is not None:
+                probs_at_sot = logits[:, self.sot_index].float().softmax(dim=-1)
+                no_speech_probs = probs_at_sot[:, self.tokenizer.no_speech].tolist()
+
+            for j in range(n_draft + 1):
+                step_logits = logits[:, pending.shape[-1] - 1 + j].clone()
+                for logit_filter in self.logit_filters:
+                    logit_filter.apply(step_logits, tokens)
+
+                tokens, completed = self.decoder.update(tokens, step_logits, sum_logprobs)
+                n_generated += 1
+                self.stats.tokens += 1
+
+                if completed or n_generated >= self.sample_len or tokens.shape[-1] > self.n_ctx:
+                    done = True
+                    break
+                if j == n_draft or tokens[0, -1] != proposals[0, j]:
+                    break
+                self.stats.accepted += 1
+
+            # Everything but the newest token has now been run through the main
+            # model; the draft is valid up to the last proposal that was kept
+            main.length = tokens.shape[-1] - 1
+            draft.length = min(draft.length, tokens.shape[-1] - 1)
+
+        return tokens, sum_logprobs, no_speech_probs
+
+    def _propose(self, draft, tokens, n_draft):
+        """Greedily extend ``tokens`` by up to ``n_draft`` tokens with the draft model."""
+        context = tokens
+        for _ in range(n_draft):
+            logits = draft(context[:, draft.length:])[:, -1]
+            for logit_filter in self.logit_filters:
+                logit_filter.apply(logits, context)
+
+            next_token = logits.argmax(dim=-1, keepdim=True)
+            context = torch.cat([context, next_token], dim=-1)
+            if next_token.item() == self.tokenizer.eot:
+                break
+
+        return context[:, tokens.shape[-1]:]
+
+
+def check_draft_compatible(model, draft_model):
+    """Raise if the draft model cannot propose tokens for the main model."""
+    if draft_model.dims.n_vocab != model.dims.n_vocab:
+        raise RuntimeError(
+            f"Draft model vocabulary ({draft_model.dims.n_vocab}) does not match "
+            f"the main model ({model.dims.n_vocab})"
+        )
+    if draft_model.dims.n_mels != model.dims.n_mels:
+        raise RuntimeError(
+            f"Draft model expects {draft_model.dims.n_mels} mel bins but the main model uses {model.dims.n_mels}"
+        )
+
+
+def install_speculative_decoding(model, draft_model, n_draft_tokens=4):
+    """
+    Make ``model.decode`` (and therefore whisper.transcribe) use assisted generation.
+
+    Parameters:
+    -----------
+    model : whisper.model.Whisper
+        The main model, whose greedy choices decide which proposals are kept
+    draft_model : whisper.model.Whisper
+        A smaller checkpoint sharing the main model's tokenizer and mel settings
+    n_draft_tokens : int
+        How many tokens the draft model proposes per verification pass
+
+    Returns:
+    --------
+    stats : SpeculativeStats
+        Counters updated as windows are decoded
+    """
+    check_draft_compatible(model, draft_model)
+
+    stats = SpeculativeStats()
+    setup = install_decoding_hooks(model)
+    setup.task_class = SpeculativeDecodingTask
+    setup.task_kwargs = dict(draft_model=draft_model, n_draft_tokens=n_draft_tokens, stats=stats)
+    return stats
@@ -0,0 +1,207 @@
+"""
+Streaming Audio - bounded-memory transcription for very long recordings
+
+whisper.transcribe(audio=path) decodes the whole file into one float32 array
+(about 230 MB per hour) before the first window is encoded. This module instead
+reads 16 kHz mono PCM from an FFmpeg pipe into a fixed-size ring buffer and runs
+Whisper's sliding-window transcription one chunk at a time. The unfinished tail
+of every chunk stays in the buffer and is decoded again with the next chunk, so
+peak memory depends on the chunk size and not on the length of the file.
+"""
+
+import subprocess
+import tempfile
+
+import numpy as np
+import whisper
+from whisper.audio import N_SAMPLES, SAMPLE_RATE
+
+
+class PCMStream:
+    """Decode an audio file to 16 kHz mono float32 samples through an FFmpeg pipe."""
+
+    def __init__(self, file_path, ffmpeg_path="ffmpeg", block_samples=SAMPLE_RATE * 10):
+        self.file_path = file_path
+        # FFmpeg's errors go to a file: a pipe nobody reads until close() would fill up
+        # on a damaged recording and block FFmpeg, and with it every read()
+        self._errors = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            [
+                ffmpeg_path, "-nostdin", "-loglevel", "error", "-threads", "0",
+                "-i", file_path,
+                "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE),
+                "-",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=self._errors,
+        )
+        # Scratch buffers are reused for every read so decoding never allocates per block
+        self._raw = bytearray(block_samples * 2)
+        self._pcm = np.frombuffer(self._raw, dtype=np.int16)
+        self._samples = np.empty(block_samples, dtype=np.float32)
+
+    def read(self, max_samples):
+        """Return up to ``max_samples`` samples; an empty array means end of stream."""
+        n_bytes = min(max_samples, len(self._samples)) * 2
+        view = memoryview(self._raw)[:n_bytes]
+        filled = 0
+        while filled < n_bytes:
+            n_read = self.process.stdout.readinto(view[filled:])
+            if not n_read:
+                break
+            filled += n_read
+
+        n_samples = filled // 2
+        np.multiply(self._pcm[:n_samples], 1 / 32768.0, out=self._samples[:n_samples], casting="unsafe")
+        return self._samples[:n_samples]
+
+    def close(self, check=True):
+        """Stop FFmpeg and, if ``check``, raise when it could not decode the file."""
+        if not check and self.process.poll() is None:
+            self.process.kill()
+        self.process.stdout.close()
+        returncode = self.process.wait()
+        self._errors.seek(0)
+        errors = self._errors.read().decode(errors="replace").strip()
+        self._errors.close()
+        if check and returncode != 0:
+            raise RuntimeError(f"Failed to decode {self.file_path}: {errors or f'ffmpeg exited with {returncode}'}")
+
+
+class RingBuffer:
+    """Fixed-capacity FIFO of float32 samples backed by a single preallocated array."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=np.float32)
+        self._start = 0
+        self.size = 0
+
+    @property
+    def free(self):
+        return self.capacity - self.size
+
+    def write(self, samples):
+        """Append samples; the caller must not write more than ``free``."""
+        if len(samples) > self.free:
+            raise ValueError(f"Cannot write {len(samples)} samples, only {self.free} free")
+
+        end = (self._start + self.size) % self.capacity
+        first = min(len(samples), self.capacity - end)
+        self._data[end:end + first] = samples[:first]
+        self._data[:len(samples) - first] = samples[first:]
+        self.size += len(samples)
+
+    def peek(self, out):
+        """Copy the buffered samples, oldest first, into ``out`` and return that view."""
+        first = min(self.size, self.capacity - self._start)
+        out[:first] = self._data[self._start:self._start + first]
+        out[first:self.size] = self._data[:self.size - first]
+        return out[:self.size]
+
+    def consume(self, n_samples):
+        """Drop the oldest ``n_samples`` samples."""
+        n_samples = min(n_samples, self.size)
+        self._start = (self._start + n_samples) % self.capacity
+        self.size -= n_samples
+
+
+def _shift_segment(segment, seconds, segment_id):
+    """Move a chunk-relative segment (and its words) onto the file's timeline."""
+    segment = dict(segment, id=segment_id, start=segment["start"] + seconds, end=segment["end"] + seconds)
+    if "words" in segment:
+        segment["words"] = [
+            dict(word, start=word["start"] + seconds, end=word["end"] + seconds)
+            for word in segment["words"]
+        ]
+    return segment
+
+
+def transcribe_streaming(model, audio_path, chunk_seconds=60, ffmpeg_path="ffmpeg", verbose=None, **decode_options):
+    """
+    Transcribe ``audio_path`` chunk by chunk with bounded memory.
+
+    Parameters:
+    -----------
+    model : whisper.model.Whisper
+        The loaded Whisper model
+    audio_path : str
+        Path to the audio file
+    chunk_seconds : int
+        Audio held in memory at once; rounded up to whole 30-second windows
+    ffmpeg_path : str
+        FFmpeg executable used to decode the file
+    verbose : bool
+        Passed through to whisper.transcribe
+    decode_options : dict
+        Any other whisper.transcribe keyword arguments
+
+    Returns:
+    --------
+    dict
+        Same shape as whisper.transcribe's result: text, segments and language
+    """
+    window = N_SAMPLES
+    chunk_samples = max(1, -(-chunk_seconds * SAMPLE_RATE // window)) * window
+
+    ring = RingBuffer(chunk_samples)
+    chunk = np.empty(chunk_samples, dtype=np.float32)
+    stream = PCMStream(audio_path, ffmpeg_path)
+
+    prompt = decode_options.pop("initial_prompt", None)
+    condition_on_previous_text = decode_options.get("condition_on_previous_text", True)
+
+    segments = []
+    language = decode_options.get("language")
+    consumed = 0
+    end_of_stream = False
+
+    try:
+        while True:
+            # Top the ring buffer up with freshly decoded PCM
+            while ring.free and not end_of_stream:
+                samples = stream.read(ring.free)
+                if len(samples) == 0:
+                    end_of_stream = True
+                    break
+                ring.write(samples)
+
+            if ring.size == 0:
+                break
+
+            result = whisper.transcribe(
+                model, ring.peek(chunk), initial_prompt=prompt, verbose=verbose, **decode_options
+            )
+            # Detect the language once, like whisper.transcribe does for a whole file
+            language = decode_options["language"] = result.get("language", language)
+            chunk_segments = result["segments"]
+
+            if not end_of_stream and len(chunk_segments) > 1:
+                # The last segment may be cut by the chunk boundary; keep its
+                # audio in the buffer and decode it again with the next chunk
+                chunk_segments = chunk_segments[:-1]
+                advance = int(chunk_segments[-1]["end"] * SAMPLE_RATE)
+                advance = min(max(advance, 1), ring.size)
+            else:
+                advance = ring.size
+
+            offset = consumed / SAMPLE_RATE
+            for segment in chunk_segments:
+                segments.append(_shift_segment(segment, offset, len(segments)))
+
+            if condition_on_previous_text and chunk_segments:
+                prompt = "".join(segment["text"] for segment in chunk_segments)
+
+            ring.consume(advance)
+            consumed += advance
+    except BaseException:
+        stream.close(check=False)
+        raise
+
+    stream.close()
+
+    return dict(
+        text="".join(segment["text"] for segment in segments),
+        segments=segments,
+        language=language,
+    )
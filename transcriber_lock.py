@@ -0,0 +1,82 @@
+"""
+Transcriber Lock
+
+Lets background jobs such as archive_transcoder.py tell whether local_whisper.py
+is running on this machine, whatever it is working on: the regular downloads,
+a --reprocess-degraded pass or a calibration.
+
+Every local_whisper.py process holds an exclusive OS lock on its own file in
+.transcribing/ for as long as it runs. The OS drops the lock when the process
+exits, even if it crashes, so a file whose lock can be taken belongs to a run
+that has ended.
+"""
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+ACTIVE_DIRECTORY = '.transcribing'
+# A lock file this old with a free lock is left over from a crashed run
+STALE_SECONDS = 60
+# How long a starting transcriber retries while a transcriber_running() check holds its lock
+LOCK_TIMEOUT_SECONDS = 10
+
+def _try_lock(f):
+    """Take a non-blocking exclusive lock on an open file; False if another process holds it"""
+    try:
+        if sys.platform == 'win32':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+@contextmanager
+def transcribing(directory=ACTIVE_DIRECTORY):
+    """Mark this process as a running transcriber until the block exits"""
+    os.makedirs(directory, exist_ok=True)
+    lock_path = os.path.join(directory, f"{os.getpid()}.lock")
+    lock_file = open(lock_path, 'w', encoding='utf-8')
+    try:
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        # A check may hold the lock for a moment; never run without it, or the
+        # check would take this run for a crashed one
+        give_up = time.time() + LOCK_TIMEOUT_SECONDS
+        while not _try_lock(lock_file):
+            if time.time() > give_up:
+                raise RuntimeError(f"Could not lock {lock_path}")
+            time.sleep(0.05)
+        yield
+    finally:
+        lock_file.close()
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+def transcriber_running(directory=ACTIVE_DIRECTORY):
+    """True while any local_whisper.py process on this machine holds its lock"""
+    if not os.path.isdir(directory):
+        return False
+
+    running = False
+    for name in os.listdir(directory):
+        lock_path = os.path.join(directory, name)
+        try:
+            with open(lock_path, 'r+', encoding='utf-8') as f:
+                if not _try_lock(f):
+                    running = True
+                    continue
+            # Give a just-started transcriber time to take its lock before cleaning up
+            if time.time() - os.path.getmtime(lock_path) > STALE_SECONDS:
+                os.remove(lock_path)
+        except OSError:
+            # Removed by its owner while we looked
+            continue
+    return running